@@ -0,0 +1,927 @@
+# benchmark.py
+
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+import spellang_interpreter
+from spellang_interpreter import (ENGINES, ASTNode, BufferedSink, Environment, FileSink, Interpreter, Lexer, MemorySink,
+                                  Optimizer, Parser, ParserError, Resolver, SlotEnvironment, StreamingParser,
+                                  class_layout)
+
+# Program Generator
+def generate_program(lines, first=0):
+    # Produces a syntactically valid SpellLang program of roughly `lines` lines,
+    # cycling through the statement forms the parser understands.
+    chunk = [
+        'Wand total_{n} = {n} * 60 * 60 + {n} % 7 - 3',
+        'Wand name_{n} = "wizard number " + "{n}"',
+        'Incantation spell_{n}(a, b) {{',
+        '    Ifar a > b && !(a == {n}) {{',
+        '        Illuminate(a - b)',
+        '    }} Elsear {{',
+        '        Illuminate(b - a)',
+        '    }}',
+        '}}',
+        'total_{n} = total_{n} + 1',
+    ]
+    out = []
+    n = first
+    while len(out) < lines:
+        out.extend(line.format(n=n) for line in chunk)
+        n += 1
+    return '\n'.join(out[:lines]) + '\n'
+
+def generate_arithmetic(lines, operands=100):
+    # Long flat arithmetic expressions, as emitted by code generators
+    ops = ['+', '-', '*', '/', '%', '+', '-', '*']
+    out = []
+    for n in range(lines):
+        terms = [str(n)]
+        for i in range(1, operands):
+            operand = f'x_{i % 7}' if i % 3 else f'({i} - y)'
+            terms.append(f'{ops[(n + i) % len(ops)]} {operand}')
+        out.append(f'Wand e_{n} = ' + ' '.join(terms))
+    return '\n'.join(out) + '\n'
+
+def best_of(func, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run_program(code, engine=Interpreter, resolve=None, optimize=False):
+    # resolve=None resolves scopes exactly when the command line would
+    tree = Parser(Lexer(code).tokenize()).parse()
+    if optimize:
+        Optimizer().optimize(tree)
+    if engine.resolve_scopes if resolve is None else resolve:
+        Resolver().resolve(tree)
+    return run_tree(tree, engine)
+
+def run_tree(tree, engine=Interpreter):
+    output = io.StringIO()
+    with redirect_stdout(output):
+        engine(tree).interpret()
+    return output.getvalue()
+
+# Benchmarks
+def bench_lexer():
+    code = generate_program(50000)
+    count = len(Lexer(code).tokenize())
+    elapsed = best_of(lambda: Lexer(code).tokenize())
+    print(f"lexer: 50000 lines, {count} tokens, {elapsed:.3f}s, {count / elapsed:,.0f} tokens/sec")
+
+def bench_lexer_small():
+    # Lexer construction plus tokenize, per script, for distinct sources (every
+    # script is new) and for the same source submitted over and over again
+    for lines, count in ((1, 20000), (10, 5000), (1000, 50)):
+        scripts = [generate_program(lines, first=i) for i in range(count)]
+        unique = best_of(lambda: [Lexer(code).tokenize() for code in scripts], repeat=3)
+        same = scripts[0]
+        repeated = best_of(lambda: [Lexer(same).tokenize() for _ in range(count)], repeat=3)
+        print(f"lexer-small: {lines:>4} line(s), unique {unique / count * 1e6:9.1f} us/script, "
+              f"repeated {repeated / count * 1e6:9.1f} us/script")
+
+def bench_parser():
+    code = generate_program(50000)
+    tokens = Lexer(code).tokenize()
+    elapsed = best_of(lambda: Parser(tokens).parse())
+    print(f"parser: 50000 lines, {elapsed:.3f}s, {len(tokens) / elapsed:,.0f} tokens/sec")
+
+def bench_expressions():
+    code = generate_arithmetic(2000)
+    tokens = Lexer(code).tokenize()
+    elapsed = best_of(lambda: Parser(tokens).parse())
+    print(f"expressions: 2000 lines x 100 operands, {elapsed:.3f}s, {len(tokens) / elapsed:,.0f} tokens/sec")
+
+def bench_loop():
+    iterations = 200000
+    code = f"""
+Wand i = 0
+Wand total = 0
+Persistus i < {iterations} {{
+    total = total + i * 2
+    i = i + 1
+}}
+Illuminate(total)
+"""
+    for name, engine in ENGINES.items():
+        elapsed = best_of(lambda: run_program(code, engine), repeat=3)
+        print(f"loop: {name:>7}, Persistus x {iterations}, {elapsed:.3f}s, {iterations / elapsed:,.0f} iterations/sec")
+
+def bench_calls():
+    calls = 50000
+    code = f"""
+Wand total = 0
+Incantation step(a, b) {{
+    Ifar a % 3 == 0 || b > a {{
+        total = total + a * b - (a + b) / 2
+    }} Elsear {{
+        total = total - 1
+    }}
+}}
+Loopus i = 0; i < {calls}; i = i + 1 {{
+    Cast step(i, 7)
+}}
+Illuminate(total)
+"""
+    for name, engine in ENGINES.items():
+        elapsed = best_of(lambda: run_program(code, engine), repeat=3)
+        print(f"calls: {name:>7}, Incantation x {calls}, {elapsed:.3f}s, {calls / elapsed:,.0f} calls/sec")
+
+ENGINE_WORKLOADS = {
+    'arithmetic': """
+Wand i = 0
+Wand acc = 0
+Persistus i < 100000 {
+    acc = (acc + i * 3 - i / 2) % 1000 + (i % 7) * (i % 11)
+    i = i + 1
+}
+Illuminate(acc)
+""",
+    'nested-loops': """
+Wand total = 0
+Loopus a = 0; a < 200; a = a + 1 {
+    Loopus b = 0; b < 200; b = b + 1 {
+        Ifar a % 2 == 0 && b % 3 == 0 {
+            total = total + 1
+        }
+    }
+}
+Illuminate(total)
+""",
+    'calls': """
+Wand total = 0
+Incantation bump(n) {
+    total = total + n
+}
+Loopus i = 0; i < 50000; i = i + 1 {
+    Cast bump(i)
+}
+Illuminate(total)
+""",
+    'protego': """
+Wand errors = 0
+Loopus i = 0; i < 30000; i = i + 1 {
+    Protego {
+        Wand r = 10 / (i % 5)
+    } Alohomora {
+        errors = errors + 1
+    }
+}
+Illuminate(errors)
+""",
+    'creatures': """
+Magical Creature Owl(name, weight) {
+    Wand heavy = weight > 3
+}
+Loopus i = 0; i < 20000; i = i + 1 {
+    Wand owl = Owl("Hedwig", i % 6)
+}
+Illuminate("done")
+""",
+    'collections': """
+Wand n = 0
+Persistus n < 30000 {
+    Wand row = [n, n + 1, {"n": n, "s": "x" + str(n)}]
+    n = n + 1
+}
+Illuminate(n)
+""",
+}
+
+def bench_engines():
+    names = list(ENGINES)
+    print(f"engines: {'workload':<13}" + ''.join(f"{name:>10}" for name in names) + "  (seconds, speedup vs tree)")
+    for workload, code in ENGINE_WORKLOADS.items():
+        outputs = {name: run_program(code, ENGINES[name]) for name in names}
+        assert len(set(outputs.values())) == 1, f"engines disagree on {workload}: {outputs}"
+        times = {name: best_of(lambda: run_program(code, ENGINES[name]), repeat=3) for name in names}
+        cells = ''.join(f"{times[name]:>7.3f}{'':>3}" for name in names)
+        speedups = ', '.join(f"{name} {times['tree'] / times[name]:.2f}x" for name in names[1:])
+        print(f"engines: {workload:<13}{cells}  {speedups}")
+
+def bench_resolver():
+    # Variables read from one to three blocks out, inside an Incantation
+    code = """
+Wand total = 0
+Incantation grid(n) {
+    Wand acc = 0
+    Loopus a = 0; a < n; a = a + 1 {
+        Loopus b = 0; b < n; b = b + 1 {
+            Loopus c = 0; c < n; c = c + 1 {
+                acc = acc + a * b - c
+            }
+        }
+    }
+    total = total + acc
+}
+Cast grid(50)
+Illuminate(total)
+"""
+    for name in ('tree', 'closure'):
+        engine = ENGINES[name]
+        assert run_program(code, engine, resolve=False) == run_program(code, engine, resolve=True)
+        by_name = best_of(lambda: run_program(code, engine, resolve=False), repeat=5)
+        by_slot = best_of(lambda: run_program(code, engine, resolve=True), repeat=5)
+        print(f"resolver: {name:>7}, nested loops x 125000, by name {by_name:.3f}s, "
+              f"by slot {by_slot:.3f}s, {by_name / by_slot:.2f}x")
+
+def bench_counting():
+    # Counting Loopus loops, run on a Python range once the Resolver has
+    # recognised them, against the generic condition/increment path
+    iterations = 10000000
+    empty = f"""
+Loopus i = 0; i < {iterations}; i = i + 1 {{
+}}
+Illuminate(i)
+"""
+    summing = f"""
+Wand total = 0
+Wand n = {iterations // 10}
+Loopus i = 0; i < n; i = i + 1 {{
+    total = total + i
+}}
+Illuminate(total)
+"""
+    for workload, code, count in (('empty body', empty, iterations), ('summing', summing, iterations // 10)):
+        for name in ('tree', 'closure', 'vm'):
+            engine = ENGINES[name]
+            tree = Parser(Lexer(code).tokenize()).parse()
+            if engine.resolve_scopes:
+                Resolver().resolve(tree)
+                counting, tree.statements[-2].counting = tree.statements[-2].counting, None
+                generic = best_of(lambda: run_tree(tree, engine), repeat=1)
+                tree.statements[-2].counting = counting
+            native = best_of(lambda: run_tree(tree, engine), repeat=1)
+            if engine.resolve_scopes:
+                print(f"counting: {workload:<10} {name:>7}, {count:,} iterations, generic {generic:.2f}s, "
+                      f"range {native:.2f}s, {generic / native:.1f}x")
+            else:
+                print(f"counting: {workload:<10} {name:>7}, {count:,} iterations, {native:.2f}s (no range path)")
+
+def bench_guards():
+    # Nested Ifar guards whose expensive Incantation call can be skipped
+    iterations = 20000
+    code = f"""
+Wand costly_calls = 0
+Incantation costly(n) {{
+    costly_calls = costly_calls + 1
+    Wand k = 0
+    Persistus k < 50 {{
+        k = k + 1
+    }}
+}}
+Wand hits = 0
+Loopus i = 0; i < {iterations}; i = i + 1 {{
+    Ifar i % 4 == 0 && costly(i) || i % 2 == 1 {{
+        Ifar i % 3 != 0 || costly(i) {{
+            Ifar i > {iterations} && costly(i) {{
+                hits = hits - 1
+            }}
+            hits = hits + 1
+        }}
+    }}
+}}
+Illuminate(hits)
+Illuminate(costly_calls)
+"""
+    for name, engine in ENGINES.items():
+        hits, calls = run_program(code, engine).split()
+        elapsed = best_of(lambda: run_program(code, engine), repeat=3)
+        print(f"guards: {name:>7}, {iterations} iterations, {calls} costly calls, {elapsed:.3f}s")
+
+def bench_optimizer():
+    code = generate_program(50000)
+    tree = Parser(Lexer(code).tokenize()).parse()
+    nodes = count_nodes(tree)
+    optimizer = Optimizer()
+    elapsed = best_of(lambda: optimizer.optimize(Parser(Lexer(code).tokenize()).parse()), repeat=3)
+    print(f"optimizer: 50000 generated lines, {nodes} nodes, {optimizer.removed} removed "
+          f"({optimizer.removed / nodes:.0%}), lex+parse+optimize {elapsed:.3f}s")
+    iterations = 100000
+    loop = f"""
+Wand i = 0
+Wand total = 0
+Persistus i < {iterations} {{
+    total = (total + 60 * 60 * 24 + (i - 1) * 1 - 0) % (1000 * 1000)
+    Wand label = "spell " + "number " + "of the " + "day"
+    i = i + 1
+}}
+Illuminate(total)
+"""
+    for name, engine in ENGINES.items():
+        assert run_program(loop, engine) == run_program(loop, engine, optimize=True)
+        plain = best_of(lambda: run_program(loop, engine), repeat=3)
+        folded = best_of(lambda: run_program(loop, engine, optimize=True), repeat=3)
+        print(f"optimizer: {name:>7}, literal-heavy loop x {iterations}, {plain:.3f}s -> {folded:.3f}s, "
+              f"{plain / folded:.2f}x")
+
+def bench_call_sites():
+    # Monomorphic call sites inside a loop, plus one site whose callee changes
+    calls = 50000
+    code = f"""
+Wand total = 0
+Incantation add(a, b) {{
+    total = total + a + b
+}}
+Incantation sub(a, b) {{
+    total = total - a - b
+}}
+Wand op = add
+Loopus i = 0; i < {calls}; i = i + 1 {{
+    Cast add(i, 1)
+    Wand label = str(i)
+    Ifar i % 1000 == 0 {{
+        Ifar op == add {{
+            op = sub
+        }} Elsear {{
+            op = add
+        }}
+    }}
+    Cast op(i, 2)
+}}
+Illuminate(total)
+"""
+    for name, engine in ENGINES.items():
+        tree = Parser(Lexer(code).tokenize()).parse()
+        if engine.resolve_scopes:
+            Resolver().resolve(tree)
+        interpreter = engine(tree)
+        with redirect_stdout(io.StringIO()):
+            elapsed = best_of(interpreter.interpret, repeat=1)
+        stats = interpreter.call_cache_stats()
+        print(f"call-sites: {name:>7}, {3 * calls} calls at {stats['sites']} sites, {elapsed:.3f}s, "
+              f"hits {stats['hits']}, misses {stats['misses']} "
+              f"({stats['hits'] / (stats['hits'] + stats['misses']):.2%} hit rate)")
+
+def bench_instantiation():
+    # Creatures whose Incantations are only reached as members: the method
+    # table is built once per class, against running every Incantation
+    # declaration again for each instance
+    instances = 100000
+    code = f"""
+Magical Creature Wizard(name, house) {{
+    Wand spells = 0
+    Wand wand = "holly"
+    Incantation cast_spell(spell) {{
+        spells = spells + 1
+    }}
+    Incantation greet(other) {{
+        Illuminate(name + " greets " + other)
+    }}
+    Incantation sort(hat) {{
+        Illuminate(hat + " says " + house)
+    }}
+    Incantation duel(rival) {{
+        Illuminate(name + " duels " + rival)
+    }}
+    Incantation describe() {{
+        Illuminate(name + " of " + house + " with a " + wand + " wand")
+    }}
+}}
+Loopus i = 0; i < {instances}; i = i + 1 {{
+    Wand wizard = Wizard("Harry", "Gryffindor")
+}}
+Wand last = Wizard("Hermione", "Gryffindor")
+last.cast_spell("Alohomora")
+Illuminate(last.spells)
+"""
+    for name, engine in ENGINES.items():
+        tree = Parser(Lexer(code).tokenize()).parse()
+        if engine.resolve_scopes:
+            Resolver().resolve(tree)
+        declaration = tree.statements[0]
+        methods, init = class_layout(declaration)
+        declaration.layout = ({}, declaration.body)
+        per_instance = best_of(lambda: run_tree(tree, engine), repeat=3)
+        declaration.layout = (methods, init)
+        table = best_of(lambda: run_tree(tree, engine), repeat=3)
+        print(f"instantiation: {name:>7}, {instances} instances, methods per instance {per_instance:.3f}s, "
+              f"method table {table:.3f}s, {per_instance / table:.2f}x, "
+              f"{instances / table:,.0f} instances/s")
+
+def bench_shapes():
+    # Memory held per live creature, and a loop reading fields through member
+    # access sites
+    instances = 100000
+    reads = 200000
+    code = f"""
+Magical Creature Owl(name, weight, age) {{
+    Wand heavy = weight > 3
+    Wand color = "snowy"
+    Incantation hoot() {{
+        Illuminate(name + " hoots")
+    }}
+}}
+Wand hedwig = Owl("Hedwig", 2, 7)
+Wand total = 0
+Loopus i = 0; i < {reads}; i = i + 1 {{
+    total = total + hedwig.weight + hedwig.age
+}}
+Illuminate(total)
+"""
+    for name, engine in ENGINES.items():
+        tree = Parser(Lexer(code).tokenize()).parse()
+        if engine.resolve_scopes:
+            Resolver().resolve(tree)
+        interpreter = engine(tree)
+        with redirect_stdout(io.StringIO()):
+            elapsed = best_of(interpreter.interpret, repeat=3)
+        owl = interpreter.classes['Owl']
+        tracemalloc.start()
+        try:
+            herd = [owl.call(interpreter, ["Hedwig", i, 7]) for i in range(instances)]
+            per_instance = tracemalloc.get_traced_memory()[0] / len(herd)
+        finally:
+            tracemalloc.stop()
+        print(f"shapes: {name:>7}, {per_instance:.0f} bytes per instance, "
+              f"{2 * reads} field reads {elapsed:.3f}s")
+
+def bench_inheritance():
+    # A fresh creature from the bottom of a 10-level Bloodline chain each
+    # iteration, calling a method declared at the top that reads and writes
+    # a field of the instance
+    levels = 10
+    calls = 100000
+    chain = '\n'.join(f"Magical Creature Creature{level}(start) Bloodline Creature{level - 1} {{\n}}"
+                      for level in range(1, levels + 1))
+    code = f"""
+Wand total = 0
+Magical Creature Creature0(start) {{
+    Wand spoken = start
+    Incantation speak(n) {{
+        spoken = spoken + n
+        Accio spoken
+    }}
+}}
+{chain}
+Loopus i = 0; i < {calls}; i = i + 1 {{
+    Wand creature = Creature{levels}(i)
+    total = total + creature.speak(i) + creature.spoken
+}}
+Illuminate(total)
+"""
+    for name, engine in ENGINES.items():
+        assert run_program(code, engine) == f"{2 * calls * (calls - 1)}\n"
+        elapsed = best_of(lambda: run_program(code, engine), repeat=3)
+        print(f"inheritance: {name:>7}, {levels}-level Bloodline, {calls} virtual calls, {elapsed:.3f}s")
+
+def bench_recursion():
+    # Deep SpellLang recursion and a long generated expression, which only the
+    # stack engine (and the VM, for calls) survive, and the cost per call of
+    # keeping frames on an explicit stack
+    depth = 100000
+    terms = 5000
+    calls = 100000
+    deep = f"""
+Wand depth = 0
+Incantation down(n) {{
+    Ifar n > 0 {{
+        Cast down(n - 1)
+        depth = depth + 1
+    }}
+}}
+Cast down({depth})
+Illuminate(depth)
+"""
+    chain = "Wand x = 1\nWand y = " + " + ".join(["x"] * terms) + "\nIlluminate(y)\n"
+    shallow = f"""
+Wand total = 0
+Incantation bump(n) {{
+    total = total + n
+}}
+Loopus i = 0; i < {calls}; i = i + 1 {{
+    Cast bump(i)
+}}
+Illuminate(total)
+"""
+    for workload, code in ((f"{depth}-deep recursion", deep), (f"{terms}-term expression", chain)):
+        for name, engine in ENGINES.items():
+            try:
+                elapsed = best_of(lambda: run_program(code, engine), repeat=1)
+            except RecursionError:
+                print(f"recursion: {workload}, {name:>7}, RecursionError")
+            else:
+                print(f"recursion: {workload}, {name:>7}, {elapsed:.3f}s")
+    for name in ('tree', 'stack'):
+        elapsed = best_of(lambda: run_program(shallow, ENGINES[name]), repeat=3)
+        print(f"recursion: shallow calls, {name:>7}, {elapsed / calls * 1e6:.2f}us per call")
+
+def bench_tail_calls():
+    # Accumulator-style recursion a million Incantations deep. The recursive
+    # Cast is in tail position, so every engine runs it in constant stack.
+    depth = 1000000
+    code = f"""
+Incantation sum_to(n, acc) {{
+    Ifar n == 0 {{
+        Illuminate(acc)
+    }} Elsear {{
+        Cast sum_to(n - 1, acc + n)
+    }}
+}}
+Cast sum_to({depth}, 0)
+"""
+    expected = f"{depth * (depth + 1) // 2}\n"
+    for name, engine in ENGINES.items():
+        output = None
+        def run():
+            nonlocal output
+            output = run_program(code, engine)
+        elapsed = best_of(run, repeat=1)
+        assert output == expected, output
+        print(f"tail-calls: {depth}-deep tail recursion, {name:>7}, {elapsed:.3f}s")
+
+def bench_returns():
+    # Call-heavy recursion giving its results back with Accio, against the
+    # same Incantations passing them through an outer Wand as before Accio
+    workloads = {
+        'fib(20)': ("6765", """
+Incantation fib(n) {
+    Ifar n < 2 {
+        Accio n
+    }
+    Accio fib(n - 1) + fib(n - 2)
+}
+Illuminate(fib(20))
+""", """
+Wand result = 0
+Incantation fib(n) {
+    Ifar n < 2 {
+        result = n
+    } Elsear {
+        Cast fib(n - 1)
+        Wand a = result
+        Cast fib(n - 2)
+        result = a + result
+    }
+}
+Cast fib(20)
+Illuminate(result)
+"""),
+        'ackermann(3, 3) x10': ("61", """
+Incantation ack(m, n) {
+    Ifar m == 0 {
+        Accio n + 1
+    } Elsear {
+        Ifar n == 0 {
+            Accio ack(m - 1, 1)
+        } Elsear {
+            Accio ack(m - 1, ack(m, n - 1))
+        }
+    }
+}
+Wand r = 0
+Loopus i = 0; i < 10; i = i + 1 {
+    r = ack(3, 3)
+}
+Illuminate(r)
+""", """
+Wand result = 0
+Incantation ack(m, n) {
+    Ifar m == 0 {
+        result = n + 1
+    } Elsear {
+        Ifar n == 0 {
+            Cast ack(m - 1, 1)
+        } Elsear {
+            Cast ack(m, n - 1)
+            Cast ack(m - 1, result)
+        }
+    }
+}
+Loopus i = 0; i < 10; i = i + 1 {
+    Cast ack(3, 3)
+}
+Illuminate(result)
+"""),
+    }
+    for workload, (expected, accio, wand) in workloads.items():
+        for name, engine in ENGINES.items():
+            times = []
+            for code in (accio, wand):
+                output = None
+                def run():
+                    nonlocal output
+                    output = run_program(code, engine)
+                times.append(best_of(run))
+                assert output == expected + "\n", output
+            print(f"returns: {workload}, {name:>7}, Accio {times[0]:.3f}s, "
+                  f"outer Wand {times[1]:.3f}s, {times[1] / times[0]:.2f}x")
+
+def bench_memoization():
+    # fib with and without Remembrall, and an LRU cache smaller and larger
+    # than the set of arguments a loop cycles through
+    depth = 22
+    fib = """
+{marker}Incantation fib(n) {{
+    Ifar n < 2 {{
+        Accio n
+    }}
+    Accio fib(n - 1) + fib(n - 2)
+}}
+Illuminate(fib({depth}))
+"""
+    calls = 20000
+    cycle = 24
+    lookups = """
+Remembrall({size}) Incantation cube(x) {{
+    Accio x * x * x
+}}
+Wand total = 0
+Loopus i = 0; i < {calls}; i = i + 1 {{
+    total = total + cube(i % {cycle})
+}}
+Illuminate(total)
+"""
+    # Bodies that write an outer variable, although a declaration of the
+    # same name appears elsewhere in them, must not be memoized
+    impure = ("""
+Wand g = 0
+Remembrall Incantation f(x) {
+    Incantation inner() {
+        Wand g = 1
+    }
+    g = g + x
+    Accio x
+}
+""", """
+Wand g = 0
+Remembrall Incantation f(x) {
+    g = x
+    Wand g = 2
+    Accio g
+}
+""")
+    for code in impure:
+        try:
+            Parser(Lexer(code).tokenize()).parse()
+        except ParserError:
+            continue
+        raise AssertionError(f"Remembrall accepted an Incantation that assigns an outer variable: {code}")
+    for name, engine in ENGINES.items():
+        plain = best_of(lambda: run_program(fib.format(marker='', depth=depth), engine), repeat=3)
+        memoized = best_of(lambda: run_program(fib.format(marker='Remembrall ', depth=depth), engine), repeat=3)
+        print(f"memoization: fib({depth}), {name:>7}, plain {plain:.3f}s, Remembrall {memoized * 1000:.2f}ms, "
+              f"{plain / memoized:.0f}x")
+    for size in (cycle // 2, cycle):
+        tree = Parser(Lexer(lookups.format(size=size, calls=calls, cycle=cycle)).tokenize()).parse()
+        Resolver().resolve(tree)
+        interpreter = Interpreter(tree)
+        with redirect_stdout(io.StringIO()):
+            elapsed = best_of(interpreter.interpret, repeat=1)
+        stats = interpreter.memo_stats()['cube']
+        print(f"memoization: {calls} calls cycling over {cycle} arguments, Remembrall({size}), {elapsed:.3f}s, "
+              f"hits {stats['hits']}, misses {stats['misses']}, evictions {stats['evictions']}")
+
+def bench_strings():
+    # 1 MB strings built by appending in a Persistus loop, as Ropes and with
+    # every + copying the string as before they existed
+    size = 1 << 20
+    # Records of "row i: i*i; " averaging 22 characters
+    rows = 50000
+    workloads = {
+        'appends of 16 characters': f"""
+Wand s = ""
+Wand i = 0
+Persistus i < {size // 16} {{
+    s = s + "0123456789abcdef"
+    i = i + 1
+}}
+Illuminate(str(s) == s)
+""",
+        'report records': f"""
+Wand report = ""
+Wand i = 0
+Persistus i < {rows} {{
+    report = report + "row " + str(i) + ": " + str(i * i) + "; "
+    i = i + 1
+}}
+Illuminate(str(report) == report)
+""",
+    }
+    # Past ROPE_MIN_LENGTH every operator gives what it gives on a str,
+    # error messages included
+    long = 'Wand s = "%d: "\nLoopus i = 0; i < 500; i = i + 1 {\n    s = s + "0123456789"\n}\n'
+    expressions = ('s % 7', 's % "x"', 's % s', '"x" + s', 's + s == s + str(s)', 's * 2 == 2 * s', 's == str(s)',
+                   's < "z"', 's < 1', 's - 1', '1 - s', 's * s', 's / 2', '-s', '!s')
+    for expression in expressions:
+        code = long + f"Illuminate({expression})\n"
+        for engine in ENGINES.values():
+            expected = without_ropes(lambda: run_program(code, engine))
+            assert run_program(code, engine) == expected, (expression, expected)
+    for workload, code in workloads.items():
+        for name, engine in ENGINES.items():
+            ropes = run_program(code, engine)
+            assert without_ropes(lambda: run_program(code, engine)) == ropes
+            copying = without_ropes(lambda: best_of(lambda: run_program(code, engine), repeat=1))
+            elapsed = best_of(lambda: run_program(code, engine), repeat=3)
+            print(f"strings: 1 MB from {workload}, {name:>7}, copying {copying:.3f}s, Ropes {elapsed:.3f}s, "
+                  f"{copying / elapsed:.1f}x")
+
+def without_ropes(func):
+    # func() with + copying strings of any length, as before Ropes
+    threshold = spellang_interpreter.ROPE_MIN_LENGTH
+    spellang_interpreter.ROPE_MIN_LENGTH = sys.maxsize
+    try:
+        return func()
+    finally:
+        spellang_interpreter.ROPE_MIN_LENGTH = threshold
+
+class PrintSink:
+    # Illuminate as it was before output sinks: one print() per line
+    def __init__(self, stream):
+        self.stream = stream
+    
+    def write(self, text):
+        print(text, end='', file=self.stream)
+    
+    def flush(self):
+        self.stream.flush()
+    
+    def close(self):
+        self.flush()
+
+def bench_output():
+    # Throughput of 10M Illuminate lines on the closure engine, where output
+    # is the largest share of the time, through each sink
+    lines = 10000000
+    code = f"""
+Loopus i = 0; i < {lines}; i = i + 1 {{
+    Illuminate(i)
+}}
+"""
+    tree = Parser(Lexer(code).tokenize()).parse()
+    Resolver().resolve(tree)
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, 'w') as devnull:
+        path = os.path.join(directory, 'output.txt')
+        sinks = {
+            'print() per line to /dev/null': lambda: PrintSink(devnull),
+            'BufferedSink to /dev/null': lambda: BufferedSink(devnull),
+            'FileSink': lambda: FileSink(path),
+            'MemorySink': MemorySink,
+        }
+        for label, make in sinks.items():
+            sink = make()
+            start = time.perf_counter()
+            ENGINES['closure'](tree, sink).interpret()
+            sink.close()
+            elapsed = time.perf_counter() - start
+            print(f"output: {lines} lines, {label}, {elapsed:.2f}s, {lines / elapsed / 1e6:.2f}M lines/s")
+
+def count_environments(func):
+    # Environments constructed while running func, by class
+    counts = {Environment: 0, SlotEnvironment: 0}
+    originals = {cls: cls.__init__ for cls in counts}
+    def counting(cls, init):
+        def __init__(self, *args):
+            counts[cls] += 1
+            init(self, *args)
+        return __init__
+    for cls, init in originals.items():
+        cls.__init__ = counting(cls, init)
+    try:
+        func()
+    finally:
+        for cls, init in originals.items():
+            cls.__init__ = init
+    return counts
+
+def environment_bytes(make, count=10000):
+    # Memory one live Environment holds, as traced by tracemalloc
+    tracemalloc.start()
+    try:
+        envs = [make() for _ in range(count)]
+        return tracemalloc.get_traced_memory()[0] / len(envs)
+    finally:
+        tracemalloc.stop()
+
+def bench_environments():
+    iterations = 100000
+    branches = f"""
+Wand i = 0
+Wand total = 0
+Persistus i < {iterations} {{
+    Ifar i % 2 == 0 {{
+        total = total + i
+    }} Elsear {{
+        total = total - 1
+    }}
+    i = i + 1
+}}
+Illuminate(total)
+"""
+    declares = f"""
+Wand total = 0
+Loopus i = 0; i < {iterations}; i = i + 1 {{
+    Wand half = i / 2
+    total = total + half
+}}
+Illuminate(total)
+"""
+    scope = {'half': 0}
+    sizes = {Environment: environment_bytes(lambda: Environment(None)),
+             SlotEnvironment: environment_bytes(lambda: SlotEnvironment(None, scope))}
+    print(f"environments: tracemalloc bytes per block Environment, dict {sizes[Environment]:.0f}, "
+          f"slots {sizes[SlotEnvironment]:.0f}")
+    for workload, code in (('branches', branches), ('declares', declares)):
+        for name in ('tree', 'closure'):
+            engine = ENGINES[name]
+            for label, resolve in (('before', False), ('after', True)):
+                counts = count_environments(lambda: run_program(code, engine, resolve))
+                per_iteration = sum(counts.values()) / iterations
+                allocated = sum(count * sizes[cls] for cls, count in counts.items()) / iterations
+                elapsed = best_of(lambda: run_program(code, engine, resolve), repeat=3)
+                print(f"environments: {workload:<8} {name:>7} {label:<6} {per_iteration:.2f} envs/iteration, "
+                      f"{allocated:6.1f} bytes/iteration, {elapsed:.3f}s")
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def count_nodes(value):
+    if isinstance(value, list):
+        return sum(count_nodes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(count_nodes(k) + count_nodes(v) for k, v in value.items())
+    if not isinstance(value, ASTNode):
+        return 0
+    names = set(getattr(value, '__dict__', ()))
+    for cls in type(value).__mro__:
+        names.update(getattr(cls, '__slots__', ()))
+    return 1 + sum(count_nodes(getattr(value, name, None)) for name in names)
+
+def bench_ast_memory():
+    code = generate_program(50000) + generate_arithmetic(500)
+    tokens = Lexer(code).tokenize()
+    tracemalloc.start()
+    tree = Parser(tokens).parse()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    nodes = count_nodes(tree)
+    print(f"ast-memory: {nodes} nodes, {size / 2**20:.1f} MiB, {size / nodes:.1f} bytes/node")
+
+def bench_stream():
+    code = generate_program(50000)
+    listed = peak_memory(lambda: Parser(Lexer(code).tokenize()).parse())
+    streamed = peak_memory(lambda: StreamingParser(Lexer(code).iter_tokens()).parse())
+    print(f"stream: 50000 lines, peak memory tokenize+parse {listed / 2**20:.1f} MiB, "
+          f"iter_tokens+parse {streamed / 2**20:.1f} MiB")
+    broken = code.replace('Illuminate(a - b)', 'Illuminate(a - b', 1)
+    for name, parse in (('tokenize', lambda: Parser(Lexer(broken).tokenize()).parse()),
+                        ('iter_tokens', lambda: StreamingParser(Lexer(broken).iter_tokens()).parse())):
+        start = time.perf_counter()
+        try:
+            parse()
+        except ParserError:
+            pass
+        print(f"stream: syntax error on line 5 reported after {(time.perf_counter() - start) * 1000:.2f} ms using {name}")
+
+BENCHMARKS = {
+    'lexer': bench_lexer,
+    'lexer-small': bench_lexer_small,
+    'stream': bench_stream,
+    'parser': bench_parser,
+    'expressions': bench_expressions,
+    'ast-memory': bench_ast_memory,
+    'loop': bench_loop,
+    'calls': bench_calls,
+    'engines': bench_engines,
+    'resolver': bench_resolver,
+    'environments': bench_environments,
+    'counting': bench_counting,
+    'guards': bench_guards,
+    'optimizer': bench_optimizer,
+    'call-sites': bench_call_sites,
+    'instantiation': bench_instantiation,
+    'shapes': bench_shapes,
+    'inheritance': bench_inheritance,
+    'recursion': bench_recursion,
+    'tail-calls': bench_tail_calls,
+    'returns': bench_returns,
+    'memoization': bench_memoization,
+    'output': bench_output,
+    'strings': bench_strings,
+}
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark '{name}'. Available: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+        BENCHMARKS[name]()
+
+if __name__ == "__main__":
+    main()
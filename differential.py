@@ -0,0 +1,76 @@
+# differential.py
+#
+# Runs the SpellLang programs in programs/ (or those named on the command
+# line) on each execution engine and checks that every engine prints exactly
+# what the tree-walking Interpreter prints, runtime error messages included.
+# Exits with status 1 if any output differs or any engine crashes with a
+# Python exception.
+
+import difflib
+import glob
+import io
+import os
+import sys
+from contextlib import redirect_stdout
+
+from spellang_interpreter import ENGINES, Lexer, LexerError, Optimizer, Parser, ParserError, Resolver
+
+PROGRAMS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'programs')
+
+def configurations():
+    # (label, engine, resolve, optimize) for each engine in ENGINES as the
+    # command line runs it, with --optimize, and, for an engine the Resolver
+    # normally prepares, without it. The first one, the tree walker as the
+    # command line runs it, is the reference.
+    for name, engine in ENGINES.items():
+        yield name, engine, engine.resolve_scopes, False
+        if engine.resolve_scopes:
+            yield f"{name} unresolved", engine, False, False
+        yield f"{name} --optimize", engine, engine.resolve_scopes, True
+
+def run(code, engine, resolve, optimize):
+    # What the program prints, as the command line would print it, and
+    # whether it crashed with an exception the interpreter did not report
+    output = io.StringIO()
+    with redirect_stdout(output):
+        try:
+            tree = Parser(Lexer(code).tokenize()).parse()
+            if optimize:
+                Optimizer().optimize(tree)
+            if resolve:
+                Resolver().resolve(tree)
+            engine(tree).interpret()
+        except (LexerError, ParserError) as e:
+            print(e)
+        except Exception as e:
+            return output.getvalue() + f"Crashed: {type(e).__name__}: {e}\n", True
+    return output.getvalue(), False
+
+def check(path):
+    # Number of configurations that differ from the reference on the
+    # program at path or crash, with a diff of each printed
+    with open(path) as f:
+        code = f.read()
+    failures = 0
+    reference = None
+    for label, engine, resolve, optimize in configurations():
+        output, crashed = run(code, engine, resolve, optimize)
+        if reference is None:
+            reference_label, reference = label, output
+        if crashed or output != reference:
+            failures += 1
+            print(f"{os.path.basename(path)}: {label} {'crashed' if crashed else 'differs from ' + reference_label}")
+            sys.stdout.writelines(difflib.unified_diff(reference.splitlines(True), output.splitlines(True),
+                                                       reference_label, label))
+    return failures
+
+def main():
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join(PROGRAMS, '*.spell')))
+    failures = sum(check(path) for path in paths)
+    count = len(list(configurations()))
+    print(f"{len(paths)} programs, {count} configurations, {failures} failures")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,10 @@
 
 import sys
 import re
-from collections import deque
+import argparse
+import operator
+from collections import OrderedDict, deque
+from functools import lru_cache
 
 # Define Token Types
 TOKEN_TYPES = {
@@ -19,27 +22,57 @@ TOKEN_TYPES = {
 KEYWORDS = {
     'Wand', 'Incantation', 'Cast', 'Illuminate', 'Ifar', 'Elsear',
     'Loopus', 'Persistus', 'Cauldron', 'SpellBooks', 'Protego',
-    'Alohomora', 'Magical', 'Creature', 'Bloodline', 'Forar',
-    'in', 'len',
+    'Alohomora', 'Magical', 'Creature', 'Bloodline', 'Forar', 'Accio',
+    'Remembrall', 'in', 'len',
 }
 
 # Define Operators
 OPERATORS = {
     '=', '==', '!=', '<', '>', '<=', '>=', '+', '-', '*', '/', '%',
-    '(', ')', '{', '}', '[', ']', ',', '.', '&&', '||', '!', ':',
+    '(', ')', '{', '}', '[', ']', ',', '.', '&&', '||', '!', ':', ';',
 }
 
+# Binary operator precedence, lowest to highest; all are left-associative
+BINARY_PRECEDENCE = {
+    '||': 1,
+    '&&': 2,
+    '==': 3, '!=': 3,
+    '<': 4, '>': 4, '<=': 4, '>=': 4,
+    '+': 5, '-': 5,
+    '*': 6, '/': 6, '%': 6,
+}
+
+# Prefix operators, binding tighter than any binary operator
+UNARY_OPERATORS = {'!', '-'}
+
 # Define Patterns
 TOKEN_REGEX = [
     ('NUMBER',   r'\d+'),
     ('STRING',   r'\".*?\"'),
     ('IDENTIFIER', r'[A-Za-z_][A-Za-z0-9_]*'),
-    ('OPERATOR', r'==|!=|<=|>=|&&|\|\||[=+\-*/%<>!():{},.\[\]]'),
+    ('OPERATOR', r'==|!=|<=|>=|&&|\|\||[=+\-*/%<>!():;{},.\[\]]'),
     ('NEWLINE',  r'\n'),
     ('SKIP',     r'[ \t]+'),
     ('MISMATCH', r'.'),
 ]
 
+# Single alternation of all patterns, compiled once at import time. The first
+# alternative that matches wins, exactly as when the patterns were tried in order.
+TOKEN_PATTERN = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in TOKEN_REGEX))
+
+# Results a Remembrall Incantation keeps when no size is given
+MEMO_CACHE_SIZE = 1024
+
+# Strings at least this long that + joins are kept as a Rope
+ROPE_MIN_LENGTH = 4096
+
+# Lines a BufferedSink not writing to a terminal holds before writing them out
+OUTPUT_BATCH_LINES = 8192
+
+# Scripts up to this many characters have their token stream cached
+SHORT_SCRIPT_LIMIT = 512
+SHORT_SCRIPT_CACHE_SIZE = 1024
+
 # Custom Exceptions
 class SpellLangError(Exception):
     pass
@@ -47,6 +80,8 @@ class SpellLangError(Exception):
 class LexerError(SpellLangError):
     def __init__(self, message, line, column):
         super().__init__(f"Lexer Error at line {line}, column {column}: {message}")
+        self.line = line
+        self.column = column
 
 class ParserError(SpellLangError):
     def __init__(self, message, token):
@@ -58,6 +93,8 @@ class RuntimeErrorSL(SpellLangError):
 
 # Token Class
 class Token:
+    __slots__ = ('type', 'value', 'line', 'column')
+
     def __init__(self, type_, value, line, column):
         self.type = type_
         self.value = value
@@ -68,138 +105,212 @@ class Token:
         return f"{self.type}({self.value}) at {self.line}:{self.column}"
 
 # Lexer Implementation
+def generate_tokens(code):
+    line = 1
+    line_start = -1
+    for match in TOKEN_PATTERN.finditer(code):
+        token_type = match.lastgroup
+        if token_type == 'IDENTIFIER':
+            text = match.group()
+            if text in KEYWORDS:
+                yield Token('KEYWORD', text, line, match.start() - line_start)
+            else:
+                yield Token('IDENTIFIER', sys.intern(text), line, match.start() - line_start)
+        elif token_type == 'SKIP':
+            pass
+        elif token_type == 'OPERATOR':
+            yield Token('OPERATOR', match.group(), line, match.start() - line_start)
+        elif token_type == 'NEWLINE':
+            line += 1
+            line_start = match.start()
+        elif token_type == 'NUMBER':
+            yield Token('NUMBER', int(match.group()), line, match.start() - line_start)
+        elif token_type == 'STRING':
+            yield Token('STRING', match.group()[1:-1], line, match.start() - line_start)
+        else:
+            raise LexerError(f"Unexpected character '{match.group()}'", line, match.start() - line_start)
+    yield Token('EOF', None, line, len(code) - line_start)
+
+def scan_tokens(code):
+    return list(generate_tokens(code))
+
+@lru_cache(maxsize=SHORT_SCRIPT_CACHE_SIZE)
+def scan_short_script(code):
+    # Tokens are never mutated after lexing, so cached ones can be shared
+    return tuple(scan_tokens(code))
+
 class Lexer:
+    token_regex = TOKEN_PATTERN
+
     def __init__(self, code):
         self.code = code
         self.tokens = []
         self.current_line = 1
         self.current_column = 1
-        self.token_regex = [(name, re.compile(pattern)) for name, pattern in TOKEN_REGEX]
     
     def tokenize(self):
         code = self.code
-        pos = 0
-        while pos < len(code):
-            match = None
-            for token_type, regex in self.token_regex:
-                match = regex.match(code, pos)
-                if match:
-                    text = match.group(0)
-                    if token_type == 'NEWLINE':
-                        self.current_line += 1
-                        self.current_column = 1
-                        pos = match.end()
-                        break
-                    elif token_type == 'SKIP':
-                        pos = match.end()
-                        self.current_column += len(text)
-                        break
-                    elif token_type == 'MISMATCH':
-                        raise LexerError(f"Unexpected character '{text}'", self.current_line, self.current_column)
-                    else:
-                        if token_type == 'IDENTIFIER' and text in KEYWORDS:
-                            token = Token('KEYWORD', text, self.current_line, self.current_column)
-                        elif token_type == 'IDENTIFIER':
-                            token = Token('IDENTIFIER', text, self.current_line, self.current_column)
-                        elif token_type == 'NUMBER':
-                            token = Token('NUMBER', int(text), self.current_line, self.current_column)
-                        elif token_type == 'STRING':
-                            token = Token('STRING', text[1:-1], self.current_line, self.current_column)
-                        elif token_type == 'OPERATOR':
-                            token = Token('OPERATOR', text, self.current_line, self.current_column)
-                        else:
-                            token = Token(token_type, text, self.current_line, self.current_column)
-                        self.tokens.append(token)
-                        pos = match.end()
-                        self.current_column += len(text)
-                        break
-            if not match:
-                raise LexerError("Invalid syntax", self.current_line, self.current_column)
-        self.tokens.append(Token('EOF', None, self.current_line, self.current_column))
+        try:
+            if len(code) <= SHORT_SCRIPT_LIMIT:
+                self.tokens = list(scan_short_script(code))
+            else:
+                self.tokens = scan_tokens(code)
+        except LexerError as e:
+            self.current_line, self.current_column = e.line, e.column
+            raise
+        eof = self.tokens[-1]
+        self.current_line, self.current_column = eof.line, eof.column
         return self.tokens
+    
+    def iter_tokens(self):
+        # Yields tokens as they are scanned, without building self.tokens
+        try:
+            yield from generate_tokens(self.code)
+        except LexerError as e:
+            self.current_line, self.current_column = e.line, e.column
+            raise
 
 # AST Node Definitions
 class ASTNode:
+    __slots__ = ('line', 'column')
+
     def __init__(self, line, column):
         self.line = line
         self.column = column
 
 class Program(ASTNode):
+    __slots__ = ('statements', 'scope')
+
     def __init__(self, statements):
         super().__init__(0, 0)
         self.statements = statements
+        self.scope = None
 
 class VarDeclaration(ASTNode):
+    __slots__ = ('var_type', 'name', 'value', 'slot')
+
     def __init__(self, var_type, name, value, line, column):
         super().__init__(line, column)
         self.var_type = var_type
         self.name = name
         self.value = value
+        self.slot = None
 
 class Assignment(ASTNode):
+    __slots__ = ('name', 'value', 'depth', 'slot')
+
     def __init__(self, name, value, line, column):
         super().__init__(line, column)
         self.name = name
         self.value = value
+        self.depth = None
+        self.slot = None
 
 class FunctionDeclaration(ASTNode):
+    __slots__ = ('name', 'params', 'body', 'slot', 'scope', 'memo_size')
+
     def __init__(self, name, params, body, line, column):
         super().__init__(line, column)
         self.name = name
         self.params = params
         self.body = body
+        self.slot = None
+        self.scope = None
+        # How many results a Remembrall declaration caches, else None
+        self.memo_size = None
 
 class FunctionCall(ASTNode):
+    __slots__ = ('name', 'args', 'depth', 'slot', 'tail')
+
     def __init__(self, name, args, line, column):
         super().__init__(line, column)
         self.name = name
         self.args = args
+        self.depth = None
+        self.slot = None
+        # Set by mark_tail_calls on a Cast the Incantation body ends with
+        self.tail = False
 
 class IfStatement(ASTNode):
+    __slots__ = ('condition', 'if_body', 'else_body', 'if_scope', 'else_scope')
+
     def __init__(self, condition, if_body, else_body, line, column):
         super().__init__(line, column)
         self.condition = condition
         self.if_body = if_body
         self.else_body = else_body
+        self.if_scope = None
+        self.else_scope = None
 
 class WhileLoop(ASTNode):
+    __slots__ = ('condition', 'body', 'body_scope')
+
     def __init__(self, condition, body, line, column):
         super().__init__(line, column)
         self.condition = condition
         self.body = body
+        self.body_scope = None
 
 class ForLoop(ASTNode):
-    def __init__(self, var, iterable, body, line, column):
+    __slots__ = ('init', 'condition', 'increment', 'body', 'body_scope', 'counting')
+
+    def __init__(self, init, condition, increment, body, line, column):
         super().__init__(line, column)
-        self.var = var
-        self.iterable = iterable
+        self.init = init
+        self.condition = condition
+        self.increment = increment
         self.body = body
+        self.body_scope = None
+        self.counting = None
 
 class PrintStatement(ASTNode):
+    __slots__ = ('expression',)
+
     def __init__(self, expression, line, column):
         super().__init__(line, column)
         self.expression = expression
 
+class ReturnStatement(ASTNode):
+    __slots__ = ('value',)
+
+    def __init__(self, value, line, column):
+        super().__init__(line, column)
+        self.value = value
+
 class ClassDeclaration(ASTNode):
+    __slots__ = ('name', 'params', 'body', 'slot', 'scope', 'layout')
+
     def __init__(self, name, params, body, line, column):
         super().__init__(line, column)
         self.name = name
         self.params = params
         self.body = body
+        self.slot = None
+        self.scope = None
+        self.layout = None
 
 class Inheritance(ASTNode):
+    __slots__ = ('child', 'parent', 'slot')
+
     def __init__(self, child, parent, line, column):
         super().__init__(line, column)
         self.child = child
         self.parent = parent
+        self.slot = None
 
 class TryCatch(ASTNode):
+    __slots__ = ('try_block', 'catch_block', 'try_scope', 'catch_scope')
+
     def __init__(self, try_block, catch_block, line, column):
         super().__init__(line, column)
         self.try_block = try_block
         self.catch_block = catch_block
+        self.try_scope = None
+        self.catch_scope = None
 
 class BinaryOp(ASTNode):
+    __slots__ = ('left', 'operator', 'right')
+
     def __init__(self, left, operator, right, line, column):
         super().__init__(line, column)
         self.left = left
@@ -207,37 +318,83 @@ class BinaryOp(ASTNode):
         self.right = right
 
 class UnaryOp(ASTNode):
+    __slots__ = ('operator', 'operand')
+
     def __init__(self, operator, operand, line, column):
         super().__init__(line, column)
         self.operator = operator
         self.operand = operand
 
 class Literal(ASTNode):
+    __slots__ = ('value',)
+
     def __init__(self, value, line, column):
         super().__init__(line, column)
         self.value = value
 
 class Identifier(ASTNode):
+    __slots__ = ('name', 'depth', 'slot')
+
     def __init__(self, name, line, column):
         super().__init__(line, column)
         self.name = name
+        self.depth = None
+        self.slot = None
+
+class MemberAccess(ASTNode):
+    __slots__ = ('target', 'name')
+
+    def __init__(self, target, name, line, column):
+        super().__init__(line, column)
+        self.target = target
+        self.name = name
+
+class MethodCall(ASTNode):
+    __slots__ = ('target', 'name', 'args')
+
+    def __init__(self, target, name, args, line, column):
+        super().__init__(line, column)
+        self.target = target
+        self.name = name
+        self.args = args
 
 # Parser Implementation
 class Parser:
-    def __init__(self, tokens):
-        self.tokens = deque(tokens)
-        self.current_token = self.tokens.popleft()
+    def __init__(self, tokens, start=0):
+        # Walks an indexed token array with an integer cursor. The array is never
+        # consumed, so it can be peeked into, re-parsed from any position and
+        # shared by several parsers.
+        self.tokens = tokens if isinstance(tokens, (list, tuple)) else list(tokens)
+        self.pos = start
+        self.current_token = self.tokens[start]
+        # Whether the statements being parsed are in an Incantation body
+        self.in_incantation = False
     
     def eat(self, token_type=None, value=None):
         if token_type and self.current_token.type != token_type:
             raise ParserError(f"Expected token type {token_type}, got {self.current_token.type}", self.current_token)
         if value and self.current_token.value != value:
             raise ParserError(f"Expected token value '{value}', got '{self.current_token.value}'", self.current_token)
-        self.current_token = self.tokens.popleft()
-    
-    def parse(self):
+        self.pos += 1
+        self.current_token = self.tokens[self.pos]
+    
+    def peek(self, k=1):
+        # Token k positions after current_token; past the end this is the EOF token
+        index = self.pos + k
+        if index < len(self.tokens):
+            return self.tokens[index]
+        return self.tokens[-1]
+    
+    def seek(self, pos):
+        self.pos = pos
+        self.current_token = self.tokens[pos]
+    
+    def parse(self, start=0, end=None):
+        # Parses statements from token index `start` up to EOF, or up to the first
+        # statement boundary at or after index `end`
+        self.seek(start)
         statements = []
-        while self.current_token.type != 'EOF':
+        while self.current_token.type != 'EOF' and (end is None or self.pos < end):
             stmt = self.statement()
             if stmt:
                 statements.append(stmt)
@@ -263,9 +420,15 @@ class Parser:
                 return self.try_catch()
             elif self.current_token.value == 'Magical':
                 return self.class_declaration()
+            elif self.current_token.value == 'Accio':
+                return self.return_statement()
+            elif self.current_token.value == 'Remembrall':
+                return self.memoized_declaration()
             else:
                 raise ParserError(f"Unknown keyword '{self.current_token.value}'", self.current_token)
         elif self.current_token.type == 'IDENTIFIER':
+            if self.peek().type == 'OPERATOR' and self.peek().value == '.':
+                return self.method_call_statement()
             return self.assignment()
         else:
             raise ParserError(f"Unexpected token '{self.current_token.value}'", self.current_token)
@@ -313,17 +476,43 @@ class Parser:
         self.eat('OPERATOR', ')')
         self.eat('OPERATOR', '{')
         body = []
+        outer, self.in_incantation = self.in_incantation, True
         while not (self.current_token.type == 'OPERATOR' and self.current_token.value == '}'):
             stmt = self.statement()
             if stmt:
                 body.append(stmt)
+        self.in_incantation = outer
         self.eat('OPERATOR', '}')
+        mark_tail_calls(body)
         return FunctionDeclaration(func_name, params, body, line, column)
     
+    def memoized_declaration(self):
+        # `Remembrall Incantation ...`, or `Remembrall(size) Incantation ...`
+        token = self.current_token
+        self.eat('KEYWORD', 'Remembrall')
+        size = MEMO_CACHE_SIZE
+        if self.current_token.type == 'OPERATOR' and self.current_token.value == '(':
+            self.eat('OPERATOR', '(')
+            if self.current_token.type != 'NUMBER' or self.current_token.value < 1:
+                raise ParserError("Expected a cache size of at least 1", self.current_token)
+            size = self.current_token.value
+            self.eat('NUMBER')
+            self.eat('OPERATOR', ')')
+        if self.current_token.type != 'KEYWORD' or self.current_token.value != 'Incantation':
+            raise ParserError("Expected 'Incantation' after 'Remembrall'", self.current_token)
+        node = self.function_declaration()
+        problem = impurity(node)
+        if problem is not None:
+            raise ParserError(f"Cannot memoize '{node.name}': {problem}", token)
+        node.memo_size = size
+        return node
+    
     def function_call_statement(self):
         self.eat('KEYWORD', 'Cast')
         if self.current_token.type != 'IDENTIFIER':
             raise ParserError("Expected function name after 'Cast'", self.current_token)
+        if self.peek().type == 'OPERATOR' and self.peek().value == '.':
+            return self.method_call_statement()
         func_name = self.current_token.value
         line, column = self.current_token.line, self.current_token.column
         self.eat('IDENTIFIER')
@@ -338,7 +527,32 @@ class Parser:
                 else:
                     break
         self.eat('OPERATOR', ')')
-        return FunctionCall(func_name, args, line, column)
+        call = FunctionCall(func_name, args, line, column)
+        # `Cast Wizard(...).cast_spell(...)` calls a method of the result
+        node = self.postfix(call)
+        if node is not call and not isinstance(node, MethodCall):
+            raise ParserError("Expected a method call", self.current_token)
+        return node
+    
+    def method_call_statement(self):
+        # `harry.cast_spell(...)`, with or without a leading Cast
+        token = self.current_token
+        node = self.expression()
+        if not isinstance(node, MethodCall):
+            raise ParserError("Expected a method call", token)
+        return node
+    
+    def return_statement(self):
+        # `Accio value`, or a bare `Accio` closing its block, which gives None
+        token = self.current_token
+        if not self.in_incantation:
+            raise ParserError("'Accio' outside an Incantation", token)
+        self.eat('KEYWORD', 'Accio')
+        if self.current_token.type == 'OPERATOR' and self.current_token.value == '}':
+            value = Literal(None, token.line, token.column)
+        else:
+            value = self.expression()
+        return ReturnStatement(value, token.line, token.column)
     
     def print_statement(self):
         self.eat('KEYWORD', 'Illuminate')
@@ -382,11 +596,16 @@ class Parser:
     
     def for_loop(self):
         self.eat('KEYWORD', 'Loopus')
-        init = self.expression()
+        if self.current_token.type == 'KEYWORD':
+            init = self.variable_declaration()
+        else:
+            # The counter of a Loopus is declared by the loop itself
+            counter = self.assignment()
+            init = VarDeclaration('Wand', counter.name, counter.value, counter.line, counter.column)
         self.eat('OPERATOR', ';')
         condition = self.expression()
         self.eat('OPERATOR', ';')
-        increment = self.expression()
+        increment = self.assignment()
         self.eat('OPERATOR', '{')
         body = []
         while not (self.current_token.type == 'OPERATOR' and self.current_token.value == '}'):
@@ -394,8 +613,8 @@ class Parser:
             if stmt:
                 body.append(stmt)
         self.eat('OPERATOR', '}')
-        # For simplicity, we'll treat 'Loopus' as a for loop with init, condition, and increment
-        # and encapsulate it within WhileLoop during interpretation
+        # 'Loopus' keeps its init, condition and increment; the counter declared
+        # by init lives in the enclosing scope
         return ForLoop(init, condition, increment, body, init.line, init.column)
     
     def try_catch(self):
@@ -447,84 +666,69 @@ class Parser:
             self.eat('IDENTIFIER')
         self.eat('OPERATOR', '{')
         body = []
+        outer, self.in_incantation = self.in_incantation, False
         while not (self.current_token.type == 'OPERATOR' and self.current_token.value == '}'):
             stmt = self.statement()
             if stmt:
                 body.append(stmt)
+        self.in_incantation = outer
         self.eat('OPERATOR', '}')
         return ClassDeclaration(class_name, params, body, line, column) if not inheritance else Inheritance(class_name, inheritance, line, column)
     
-    def expression(self):
-        return self.logical_or()
-    
-    def logical_or(self):
-        node = self.logical_and()
-        while self.current_token.type == 'OPERATOR' and self.current_token.value == '||':
-            op = self.current_token.value
-            line, column = self.current_token.line, self.current_token.column
-            self.eat('OPERATOR', '||')
-            right = self.logical_and()
-            node = BinaryOp(node, op, right, line, column)
-        return node
-    
-    def logical_and(self):
-        node = self.equality()
-        while self.current_token.type == 'OPERATOR' and self.current_token.value == '&&':
-            op = self.current_token.value
-            line, column = self.current_token.line, self.current_token.column
-            self.eat('OPERATOR', '&&')
-            right = self.equality()
-            node = BinaryOp(node, op, right, line, column)
-        return node
-    
-    def equality(self):
-        node = self.comparison()
-        while self.current_token.type == 'OPERATOR' and self.current_token.value in {'==', '!='}:
-            op = self.current_token.value
-            line, column = self.current_token.line, self.current_token.column
-            self.eat('OPERATOR', op)
-            right = self.comparison()
-            node = BinaryOp(node, op, right, line, column)
-        return node
-    
-    def comparison(self):
-        node = self.term()
-        while self.current_token.type == 'OPERATOR' and self.current_token.value in {'<', '>', '<=', '>='}:
-            op = self.current_token.value
-            line, column = self.current_token.line, self.current_token.column
-            self.eat('OPERATOR', op)
-            right = self.term()
-            node = BinaryOp(node, op, right, line, column)
-        return node
-    
-    def term(self):
-        node = self.factor()
-        while self.current_token.type == 'OPERATOR' and self.current_token.value in {'+', '-'}:
-            op = self.current_token.value
-            line, column = self.current_token.line, self.current_token.column
-            self.eat('OPERATOR', op)
-            right = self.factor()
-            node = BinaryOp(node, op, right, line, column)
-        return node
-    
-    def factor(self):
-        node = self.unary()
-        while self.current_token.type == 'OPERATOR' and self.current_token.value in {'*', '/', '%'}:
-            op = self.current_token.value
-            line, column = self.current_token.line, self.current_token.column
-            self.eat('OPERATOR', op)
-            right = self.unary()
-            node = BinaryOp(node, op, right, line, column)
-        return node
+    def expression(self, min_precedence=1):
+        # Precedence climbing over BINARY_PRECEDENCE. Literals, identifiers and
+        # parenthesised groups are parsed inline, so a leaf costs a single call
+        # whatever the depth of the operator table.
+        token = self.current_token
+        token_type = token.type
+        if token_type == 'NUMBER' or token_type == 'STRING':
+            self.eat()
+            node = Literal(token.value, token.line, token.column)
+        elif token_type == 'IDENTIFIER':
+            self.eat()
+            if self.current_token.type == 'OPERATOR' and self.current_token.value == '(':
+                node = self.call_expression(token)
+            else:
+                node = Identifier(token.value, token.line, token.column)
+        elif token_type == 'OPERATOR' and token.value == '(':
+            self.eat()
+            node = self.expression()
+            self.eat('OPERATOR', ')')
+        else:
+            node = self.unary()
+        if self.current_token.value == '.' and self.current_token.type == 'OPERATOR':
+            node = self.postfix(node)
+        while True:
+            token = self.current_token
+            precedence = BINARY_PRECEDENCE.get(token.value)
+            if precedence is None or precedence < min_precedence or token.type != 'OPERATOR':
+                return node
+            self.eat()
+            right = self.expression(precedence + 1)
+            node = BinaryOp(node, token.value, right, token.line, token.column)
     
     def unary(self):
-        if self.current_token.type == 'OPERATOR' and self.current_token.value in {'!', '-'}:
-            op = self.current_token.value
-            line, column = self.current_token.line, self.current_token.column
-            self.eat('OPERATOR', op)
+        token = self.current_token
+        if token.type == 'OPERATOR' and token.value in UNARY_OPERATORS:
+            self.eat()
             operand = self.unary()
-            return UnaryOp(op, operand, line, column)
-        return self.primary()
+            return UnaryOp(token.value, operand, token.line, token.column)
+        return self.postfix(self.primary())
+    
+    def postfix(self, node):
+        # Member reads and method calls chained onto a primary
+        while self.current_token.type == 'OPERATOR' and self.current_token.value == '.':
+            self.eat('OPERATOR', '.')
+            token = self.current_token
+            if token.type != 'IDENTIFIER':
+                raise ParserError("Expected member name after '.'", token)
+            self.eat('IDENTIFIER')
+            if self.current_token.type == 'OPERATOR' and self.current_token.value == '(':
+                call = self.call_expression(token)
+                node = MethodCall(node, call.name, call.args, token.line, token.column)
+            else:
+                node = MemberAccess(node, token.value, token.line, token.column)
+        return node
     
     def primary(self):
         token = self.current_token
@@ -537,20 +741,18 @@ class Parser:
         elif token.type == 'IDENTIFIER':
             self.eat('IDENTIFIER')
             if self.current_token.type == 'OPERATOR' and self.current_token.value == '(':
-                # Function call within expression
-                self.eat('OPERATOR', '(')
-                args = []
-                if self.current_token.type != 'OPERATOR' or self.current_token.value != ')':
-                    while True:
-                        arg = self.expression()
-                        args.append(arg)
-                        if self.current_token.type == 'OPERATOR' and self.current_token.value == ',':
-                            self.eat('OPERATOR', ',')
-                        else:
-                            break
-                self.eat('OPERATOR', ')')
-                return FunctionCall(token.value, args, token.line, token.column)
+                return self.call_expression(token)
             return Identifier(token.value, token.line, token.column)
+        elif token.type == 'KEYWORD' and token.value == 'Cast':
+            # `Cast Wizard(...)` as an expression is the same call as `Wizard(...)`
+            self.eat('KEYWORD', 'Cast')
+            name_token = self.current_token
+            if name_token.type != 'IDENTIFIER':
+                raise ParserError("Expected function name after 'Cast'", name_token)
+            self.eat('IDENTIFIER')
+            if self.current_token.type != 'OPERATOR' or self.current_token.value != '(':
+                raise ParserError("Expected '(' after function name", self.current_token)
+            return self.call_expression(name_token)
         elif token.type == 'OPERATOR' and token.value == '(':
             self.eat('OPERATOR', '(')
             expr = self.expression()
@@ -563,6 +765,21 @@ class Parser:
         else:
             raise ParserError(f"Unexpected token '{token.value}' in expression", token)
     
+    def call_expression(self, name_token):
+        # Function call within expression; the name has already been eaten
+        self.eat('OPERATOR', '(')
+        args = []
+        if self.current_token.type != 'OPERATOR' or self.current_token.value != ')':
+            while True:
+                arg = self.expression()
+                args.append(arg)
+                if self.current_token.type == 'OPERATOR' and self.current_token.value == ',':
+                    self.eat('OPERATOR', ',')
+                else:
+                    break
+        self.eat('OPERATOR', ')')
+        return FunctionCall(name_token.value, args, name_token.line, name_token.column)
+    
     def list_expression(self):
         line, column = self.current_token.line, self.current_token.column
         self.eat('OPERATOR', '[')
@@ -595,8 +812,597 @@ class Parser:
         self.eat('OPERATOR', '}')
         return Literal(items, line, column)
 
+class StreamingParser(Parser):
+    def __init__(self, tokens):
+        # Pulls tokens lazily from an iterator such as Lexer.iter_tokens(). Only
+        # tokens requested through peek() are buffered, so the full token list
+        # never exists; seeking backwards is not possible.
+        self.stream = iter(tokens)
+        self.lookahead = deque()
+        self.pos = 0
+        self.current_token = next(self.stream)
+        self.in_incantation = False
+    
+    def eat(self, token_type=None, value=None):
+        if token_type and self.current_token.type != token_type:
+            raise ParserError(f"Expected token type {token_type}, got {self.current_token.type}", self.current_token)
+        if value and self.current_token.value != value:
+            raise ParserError(f"Expected token value '{value}', got '{self.current_token.value}'", self.current_token)
+        self.pos += 1
+        self.current_token = self.lookahead.popleft() if self.lookahead else next(self.stream)
+    
+    def peek(self, k=1):
+        lookahead = self.lookahead
+        while len(lookahead) < k:
+            last = lookahead[-1] if lookahead else self.current_token
+            if last.type == 'EOF':
+                return last
+            lookahead.append(next(self.stream))
+        return lookahead[k - 1]
+    
+    def seek(self, pos):
+        if pos != self.pos:
+            raise ParserError("Cannot seek in a token stream", self.current_token)
+    
+    def parse(self, start=None, end=None):
+        if start is not None:
+            self.seek(start)
+        return super().parse(self.pos, end)
+
+# Scope Resolution
+def declared_name(stmt):
+    # The name a statement declares in the Environment it runs in, if any
+    if isinstance(stmt, (VarDeclaration, FunctionDeclaration, ClassDeclaration)):
+        return stmt.name
+    elif isinstance(stmt, Inheritance):
+        return stmt.child
+    elif isinstance(stmt, ForLoop):
+        return declared_name(stmt.init)
+    return None
+
+def walk(value):
+    # Every AST node in value, which may be a node or a list or dict of nodes,
+    # parents first. Kept iterative so that deeply nested expressions from
+    # generated code do not hit the recursion limit.
+    pending = [value]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, ASTNode):
+            yield value
+            children = [getattr(value, name, None) for cls in type(value).__mro__
+                        for name in getattr(cls, '__slots__', ())]
+            pending.extend(reversed(children))
+        elif isinstance(value, list):
+            pending.extend(reversed(value))
+        elif isinstance(value, dict):
+            for key, item in reversed(value.items()):
+                pending.append(item)
+                pending.append(key)
+
+def direct_nodes(tree, limit):
+    # ids of the nodes in tree with no Incantation or method call anywhere
+    # below them and at most `limit` levels deep. Running one of these with
+    # Python recursion is bounded, so StackInterpreter can hand it to the
+    # recursive Interpreter methods. Lists of such nodes, the blocks, are
+    # included too.
+    heights = {}
+    nodes = list(walk(tree))
+    for node in reversed(nodes):
+        # Children come before their parents in reversed pre-order
+        height = None if isinstance(node, (FunctionCall, MethodCall)) else 1
+        pending = [getattr(node, name, None) for cls in type(node).__mro__
+                   for name in getattr(cls, '__slots__', ())]
+        while pending and height is not None:
+            value = pending.pop()
+            if isinstance(value, ASTNode):
+                child = heights[id(value)]
+                height = None if child is None else max(height, child + 1)
+            elif isinstance(value, list):
+                pending.extend(value)
+            elif isinstance(value, dict):
+                pending.extend(value.keys())
+                pending.extend(value.values())
+        heights[id(node)] = height
+    direct = {key for key, height in heights.items() if height is not None and height <= limit}
+    for node in nodes:
+        for cls in type(node).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                value = getattr(node, name, None)
+                if isinstance(value, list) and all(id(item) in direct for item in value):
+                    direct.add(id(value))
+    return direct
+
+def mark_tail_calls(statements, ends_body=True):
+    # Flags the calls in tail position of an Incantation body: a Cast that is
+    # its last statement, or the last of either branch of an Ifar, or of the
+    # Alohomora block of a Protego, that is itself in tail position, and a
+    # call that is the whole value of an Accio anywhere outside a Protego
+    # block. Nothing in the body runs after one of these, so instead of
+    # calling the Function the engines hand it back to the frame that called
+    # the body, which runs it next. Tail recursion then takes no Python stack.
+    for index, stmt in enumerate(statements):
+        last = ends_body and index == len(statements) - 1
+        if isinstance(stmt, ReturnStatement):
+            if isinstance(stmt.value, FunctionCall):
+                stmt.value.tail = True
+        elif isinstance(stmt, FunctionCall):
+            stmt.tail = last
+        elif isinstance(stmt, IfStatement):
+            mark_tail_calls(stmt.if_body, last)
+            mark_tail_calls(stmt.else_body, last)
+        elif isinstance(stmt, (WhileLoop, ForLoop)):
+            mark_tail_calls(stmt.body, False)
+        elif isinstance(stmt, TryCatch):
+            mark_tail_calls(stmt.catch_block, last)
+
+def impurity(node):
+    # Why the Incantation declared by node could give a different result, or
+    # do something different, for the same arguments, or None if nothing
+    # shows: it must not Illuminate or assign a variable it did not declare.
+    # What it reads and the Incantations it calls are taken on trust.
+    return block_impurity(node.body, [set(node.params)])
+
+def block_impurity(statements, scopes):
+    # impurity() of statements run in a block of their own. scopes holds the
+    # names declared so far in each enclosing block of the Incantation, so an
+    # assignment is local only when an earlier declaration covers it; names
+    # declared in nested Incantations and creatures stay in their bodies.
+    names = set()
+    scopes = scopes + [names]
+    for stmt in statements:
+        if isinstance(stmt, PrintStatement):
+            return "it calls Illuminate"
+        elif isinstance(stmt, Assignment):
+            if not any(stmt.name in scope for scope in scopes):
+                return f"it assigns the outer variable '{stmt.name}'"
+            continue
+        elif isinstance(stmt, (FunctionDeclaration, ClassDeclaration)):
+            names.add(stmt.name)
+            reason = block_impurity(stmt.body, scopes + [set(stmt.params)])
+        elif isinstance(stmt, ForLoop):
+            names.add(stmt.init.name)
+            reason = block_impurity(stmt.body, scopes) or block_impurity([stmt.increment], scopes)
+        elif isinstance(stmt, IfStatement):
+            reason = block_impurity(stmt.if_body, scopes) or block_impurity(stmt.else_body, scopes)
+        elif isinstance(stmt, WhileLoop):
+            reason = block_impurity(stmt.body, scopes)
+        elif isinstance(stmt, TryCatch):
+            reason = block_impurity(stmt.try_block, scopes) or block_impurity(stmt.catch_block, scopes)
+        else:
+            name = declared_name(stmt)
+            if name is not None:
+                names.add(name)
+            continue
+        if reason is not None:
+            return reason
+    return None
+
+def contains_return(statements):
+    # Whether an Accio in statements, and not in an Incantation or creature
+    # declared there, can end the body running them
+    pending = list(statements)
+    while pending:
+        stmt = pending.pop()
+        if isinstance(stmt, ReturnStatement):
+            return True
+        elif isinstance(stmt, IfStatement):
+            pending.extend(stmt.if_body)
+            pending.extend(stmt.else_body)
+        elif isinstance(stmt, (WhileLoop, ForLoop)):
+            pending.extend(stmt.body)
+        elif isinstance(stmt, TryCatch):
+            pending.extend(stmt.try_block)
+            pending.extend(stmt.catch_block)
+    return False
+
+def class_layout(node):
+    # Splits a ClassDeclaration body into its method table and the statements
+    # run for every instance. A top-level Incantation whose name is mentioned
+    # nowhere else in the class, not even as a parameter, can only be reached
+    # as a member, so it is defined once on the Class rather than in each
+    # instance's Environment. Returns (methods, init), cached on the node as
+    # a tuple, which walk() does not descend into.
+    if node.layout is None:
+        mentions = dict.fromkeys(node.params, 1)
+        for child in walk(node.body):
+            if isinstance(child, (VarDeclaration, Assignment, FunctionDeclaration, ClassDeclaration,
+                                  FunctionCall, Identifier)):
+                mentions[child.name] = mentions.get(child.name, 0) + 1
+            elif isinstance(child, Inheritance):
+                mentions[child.child] = mentions.get(child.child, 0) + 1
+        # A Remembrall Incantation stays in each instance, with its own cache
+        methods = {stmt.name: stmt for stmt in node.body
+                   if isinstance(stmt, FunctionDeclaration) and mentions[stmt.name] == 1
+                   and stmt.memo_size is None}
+        init = [stmt for stmt in node.body
+                if not (isinstance(stmt, FunctionDeclaration) and stmt.name in methods)]
+        node.layout = (methods, init)
+    return node.layout
+
+def counting_loop(node):
+    # Recognises `Loopus i = start; i < stop; i = i + 1` (or `i <= stop`) where
+    # stop is a number or a variable and the body never assigns i. Returns
+    # (name, stop node, inclusive) or None.
+    name = node.init.name
+    condition, increment = node.condition, node.increment
+    if not (isinstance(condition, BinaryOp) and condition.operator in ('<', '<=')
+            and isinstance(condition.left, Identifier) and condition.left.name == name):
+        return None
+    stop = condition.right
+    if not (isinstance(stop, Literal) and type(stop.value) is int
+            or isinstance(stop, Identifier) and stop.name != name):
+        return None
+    step = increment.value
+    if not (increment.name == name and isinstance(step, BinaryOp) and step.operator == '+'
+            and isinstance(step.left, Identifier) and step.left.name == name
+            and isinstance(step.right, Literal) and type(step.right.value) is int and step.right.value == 1):
+        return None
+    if any(isinstance(child, Assignment) and child.name == name for child in walk(node.body)):
+        return None
+    return name, stop, condition.operator == '<='
+
+class Resolver:
+    # Static pass run between Parser.parse and execution. Every block gets a
+    # scope, a dict from the names it declares to slots in its Environment, and
+    # every variable use gets the (depth, slot) it refers to, depth counting
+    # Environment.parent hops. Names with no declaration in sight (builtins,
+    # misspellings) are left unannotated and looked up by name.
+    #
+    # The statements of one Environment run once and in order, so inside one
+    # function a use only sees declarations above it. A nested Incantation may
+    # be called later, so from inside one an enclosing scope counts all of its
+    # declarations; if the slot is still unassigned at run time, get_at carries
+    # on looking outwards by name.
+    #
+    # A block that declares nothing gets an empty scope and runs in the
+    # Environment around it, so it adds no depth.
+    def __init__(self):
+        cls = type(self)
+        if 'resolvers' not in cls.__dict__:
+            cls.resolvers = DispatchTable(cls, 'resolve_', cls.resolve_nothing)
+        self.scopes = []
+        self.activation = 0
+        self.activations = 0
+    
+    def resolve(self, program):
+        program.scope = self.resolve_block(program.statements)
+        return program
+    
+    def resolve_node(self, node):
+        self.resolvers[type(node)](self, node)
+    
+    def resolve_nothing(self, node):
+        pass
+    
+    def resolve_block(self, statements, predeclared=()):
+        scope = {}
+        for name in predeclared:
+            scope.setdefault(name, len(scope))
+        for stmt in statements:
+            name = declared_name(stmt)
+            if name is not None:
+                scope.setdefault(name, len(scope))
+        if not scope:
+            for stmt in statements:
+                self.resolve_node(stmt)
+            return scope
+        self.scopes.append((scope, set(predeclared), self.activation))
+        for stmt in statements:
+            self.resolve_node(stmt)
+        self.scopes.pop()
+        return scope
+    
+    def resolve_body(self, statements, predeclared):
+        # Function and class bodies run later, once per call
+        outer = self.activation
+        self.activations += 1
+        self.activation = self.activations
+        scope = self.resolve_block(statements, predeclared)
+        self.activation = outer
+        return scope
+    
+    def declare(self, name):
+        scope, declared, activation = self.scopes[-1]
+        declared.add(name)
+        return scope[name]
+    
+    def lookup(self, name):
+        for depth, (scope, declared, activation) in enumerate(reversed(self.scopes)):
+            if name in (declared if activation == self.activation else scope):
+                return depth, scope[name]
+        return None, None
+    
+    def resolve_VarDeclaration(self, node):
+        self.resolve_node(node.value)
+        node.slot = self.declare(node.name)
+    
+    def resolve_Assignment(self, node):
+        self.resolve_node(node.value)
+        node.depth, node.slot = self.lookup(node.name)
+    
+    def resolve_FunctionDeclaration(self, node):
+        node.slot = self.declare(node.name)
+        node.scope = self.resolve_body(node.body, node.params)
+    
+    def resolve_FunctionCall(self, node):
+        node.depth, node.slot = self.lookup(node.name)
+        for arg in node.args:
+            self.resolve_node(arg)
+    
+    def resolve_PrintStatement(self, node):
+        self.resolve_node(node.expression)
+    
+    def resolve_ReturnStatement(self, node):
+        self.resolve_node(node.value)
+    
+    def resolve_IfStatement(self, node):
+        self.resolve_node(node.condition)
+        node.if_scope = self.resolve_block(node.if_body)
+        node.else_scope = self.resolve_block(node.else_body)
+    
+    def resolve_WhileLoop(self, node):
+        self.resolve_node(node.condition)
+        node.body_scope = self.resolve_block(node.body)
+    
+    def resolve_ForLoop(self, node):
+        self.resolve_node(node.init)
+        self.resolve_node(node.condition)
+        node.body_scope = self.resolve_block(node.body)
+        self.resolve_node(node.increment)
+        node.counting = counting_loop(node)
+    
+    def resolve_ClassDeclaration(self, node):
+        node.slot = self.declare(node.name)
+        node.scope = self.resolve_body(node.body, [*node.params, 'self'])
+    
+    def resolve_Inheritance(self, node):
+        node.slot = self.declare(node.child)
+    
+    def resolve_TryCatch(self, node):
+        node.try_scope = self.resolve_block(node.try_block)
+        node.catch_scope = self.resolve_block(node.catch_block)
+    
+    def resolve_BinaryOp(self, node):
+        # Down the left operands in a loop, as generated code nests them deeply
+        rights = []
+        while isinstance(node, BinaryOp):
+            rights.append(node.right)
+            node = node.left
+        self.resolve_node(node)
+        for right in reversed(rights):
+            self.resolve_node(right)
+    
+    def resolve_UnaryOp(self, node):
+        self.resolve_node(node.operand)
+    
+    def resolve_Literal(self, node):
+        if isinstance(node.value, list):
+            for item in node.value:
+                self.resolve_node(item)
+        elif isinstance(node.value, dict):
+            for key, value in node.value.items():
+                self.resolve_node(key)
+                self.resolve_node(value)
+    
+    def resolve_Identifier(self, node):
+        node.depth, node.slot = self.lookup(node.name)
+    
+    def resolve_MemberAccess(self, node):
+        self.resolve_node(node.target)
+    
+    def resolve_MethodCall(self, node):
+        self.resolve_node(node.target)
+        for arg in node.args:
+            self.resolve_node(arg)
+
+# AST Optimizer
+class Optimizer:
+    # Optional pass run after Parser.parse. Operators whose operands are all
+    # literals are folded into a single Literal, and `x * 1`, `x - 0` and
+    # `x + 0` are reduced to x when x can only be a number (for a string,
+    # list or bool they are not identities). An operation that raises while
+    # folding stays in the tree, so the error still happens at run time at
+    # its own line and column. After optimize(), `removed` holds the number
+    # of nodes saved.
+    def __init__(self):
+        cls = type(self)
+        if 'optimizers' not in cls.__dict__:
+            cls.optimizers = DispatchTable(cls, 'optimize_', cls.optimize_leaf)
+        self.removed = 0
+    
+    def optimize(self, program):
+        before = sum(1 for node in walk(program))
+        self.optimize_block(program.statements)
+        self.removed = before - sum(1 for node in walk(program))
+        return program
+    
+    def optimize_node(self, node):
+        return self.optimizers[type(node)](self, node)
+    
+    def optimize_block(self, statements):
+        for stmt in statements:
+            self.optimize_node(stmt)
+    
+    def optimize_leaf(self, node):
+        return node
+    
+    def is_constant(self, node):
+        return isinstance(node, Literal) and not isinstance(node.value, (list, dict))
+    
+    def number_kind(self, node):
+        # 'int' if node can only evaluate to an int, 'number' if to an int or
+        # a float (never a bool), None if it may be anything else
+        if isinstance(node, Literal):
+            if type(node.value) is int:
+                return 'int'
+            elif type(node.value) is float:
+                return 'number'
+        elif isinstance(node, UnaryOp) and node.operator == '-':
+            # Only numbers negate, and -True is the int -1
+            return 'int' if self.number_kind(node.operand) == 'int' else 'number'
+        elif isinstance(node, BinaryOp) and node.operator in ('+', '-', '*', '/', '%'):
+            kinds = (self.number_kind(node.left), self.number_kind(node.right))
+            if node.operator == '/':
+                return 'number'
+            elif kinds == ('int', 'int'):
+                return 'int'
+            elif None not in kinds or node.operator == '-':
+                return 'number'
+        return None
+    
+    # Statements
+    def optimize_VarDeclaration(self, node):
+        node.value = self.optimize_node(node.value)
+        return node
+    
+    def optimize_Assignment(self, node):
+        node.value = self.optimize_node(node.value)
+        return node
+    
+    def optimize_FunctionDeclaration(self, node):
+        self.optimize_block(node.body)
+        return node
+    
+    def optimize_FunctionCall(self, node):
+        node.args = [self.optimize_node(arg) for arg in node.args]
+        return node
+    
+    def optimize_PrintStatement(self, node):
+        node.expression = self.optimize_node(node.expression)
+        return node
+    
+    def optimize_ReturnStatement(self, node):
+        node.value = self.optimize_node(node.value)
+        return node
+    
+    def optimize_IfStatement(self, node):
+        node.condition = self.optimize_node(node.condition)
+        self.optimize_block(node.if_body)
+        self.optimize_block(node.else_body)
+        return node
+    
+    def optimize_WhileLoop(self, node):
+        node.condition = self.optimize_node(node.condition)
+        self.optimize_block(node.body)
+        return node
+    
+    def optimize_ForLoop(self, node):
+        self.optimize_node(node.init)
+        node.condition = self.optimize_node(node.condition)
+        self.optimize_block(node.body)
+        self.optimize_node(node.increment)
+        return node
+    
+    def optimize_ClassDeclaration(self, node):
+        self.optimize_block(node.body)
+        return node
+    
+    def optimize_TryCatch(self, node):
+        self.optimize_block(node.try_block)
+        self.optimize_block(node.catch_block)
+        return node
+    
+    # Expressions
+    def optimize_Literal(self, node):
+        if isinstance(node.value, list):
+            node.value = [self.optimize_node(item) for item in node.value]
+        elif isinstance(node.value, dict):
+            node.value = {self.optimize_node(k): self.optimize_node(v) for k, v in node.value.items()}
+        return node
+    
+    def optimize_BinaryOp(self, node):
+        # Down the left operands in a loop, as generated code nests them
+        # deeply, then back up folding each level
+        spine = []
+        while isinstance(node, BinaryOp):
+            spine.append(node)
+            node = node.left
+        result = self.optimize_node(node)
+        for node in reversed(spine):
+            node.left = result
+            result = self.fold_binary(node)
+        return result
+    
+    def fold_binary(self, node):
+        # optimize_BinaryOp for one node whose left operand is already done
+        node.right = self.optimize_node(node.right)
+        left, op, right = node.left, node.operator, node.right
+        if self.is_constant(left):
+            # A literal left operand may decide && and || on its own
+            if op == '&&' and not left.value:
+                return Literal(False, node.line, node.column)
+            elif op == '||' and left.value:
+                return Literal(True, node.line, node.column)
+            elif self.is_constant(right):
+                return self.fold(node, lambda: self.apply_binary(op, left.value, right.value))
+        if self.is_one(right) and op == '*' or self.is_zero(right) and op == '-':
+            if self.number_kind(left) is not None:
+                return left
+        elif self.is_zero(right) and op == '+':
+            if self.number_kind(left) == 'int':
+                return left
+        elif self.is_one(left) and op == '*':
+            if self.number_kind(right) is not None:
+                return right
+        elif self.is_zero(left) and op == '+':
+            if self.number_kind(right) == 'int':
+                return right
+        return node
+    
+    def optimize_MemberAccess(self, node):
+        node.target = self.optimize_node(node.target)
+        return node
+    
+    def optimize_MethodCall(self, node):
+        node.target = self.optimize_node(node.target)
+        node.args = [self.optimize_node(arg) for arg in node.args]
+        return node
+    
+    def optimize_UnaryOp(self, node):
+        node.operand = self.optimize_node(node.operand)
+        operand = node.operand
+        if self.is_constant(operand):
+            if node.operator == '-':
+                return self.fold(node, lambda: -operand.value)
+            elif node.operator == '!':
+                return Literal(not operand.value, node.line, node.column)
+        return node
+    
+    def apply_binary(self, op, left, right):
+        if op == '&&':
+            return bool(left) and bool(right)
+        elif op == '||':
+            return bool(left) or bool(right)
+        return BINARY_FUNCTIONS[op](left, right)
+    
+    def fold(self, node, compute):
+        try:
+            value = compute()
+        except Exception:
+            # Left for the interpreter to raise, at this node's position
+            return node
+        return Literal(value, node.line, node.column)
+    
+    def is_zero(self, node):
+        return isinstance(node, Literal) and type(node.value) is int and node.value == 0
+    
+    def is_one(self, node):
+        return isinstance(node, Literal) and type(node.value) is int and node.value == 1
+
 # Environment and Interpreter
+# Marks a slot whose declaration has not run yet
+UNASSIGNED = object()
+
+# Returned by an Accio statement, and by each block and statement around it up
+# to the Incantation body, which then stops; the value is in return_value
+RETURNED = object()
+
+# Shared, always empty name dict of SlotEnvironments nothing was set in by name
+NO_VARS = {}
+
 class Environment:
+    __slots__ = ('vars', 'parent')
+    
     def __init__(self, parent=None):
         self.vars = {}
         self.parent = parent
@@ -619,65 +1425,580 @@ class Environment:
             self.parent.update(name, value)
         else:
             raise RuntimeErrorSL(f"Variable '{name}' is not defined.", None)
+    
+    def get_at(self, depth, slot, name):
+        # Read a variable the Resolver annotated with (depth, slot)
+        env = self
+        while depth:
+            env = env.parent
+            depth -= 1
+        value = env.slots[slot]
+        if value is not UNASSIGNED:
+            return value
+        elif env.parent:
+            return env.parent.get(name)
+        else:
+            raise RuntimeErrorSL(f"Variable '{name}' is not defined.", None)
+    
+    def update_at(self, depth, slot, name, value):
+        env = self
+        while depth:
+            env = env.parent
+            depth -= 1
+        if env.slots[slot] is not UNASSIGNED:
+            env.slots[slot] = value
+        elif env.parent:
+            env.parent.update(name, value)
+        else:
+            raise RuntimeErrorSL(f"Variable '{name}' is not defined.", None)
+    
+    def get_local(self, name):
+        # A variable of this Environment only, or UNASSIGNED
+        return self.vars.get(name, UNASSIGNED)
+
+class SlotEnvironment(Environment):
+    # Array-backed Environment for a block with a Resolver scope. Declared names
+    # live in `slots`; anything set by name that the scope does not know about,
+    # such as the builtins, falls back to the inherited dict.
+    __slots__ = ('scope', 'slots')
+    
+    def __init__(self, parent, scope):
+        self.vars = NO_VARS
+        self.parent = parent
+        self.scope = scope
+        self.slots = [UNASSIGNED] * len(scope)
+    
+    def get(self, name):
+        slot = self.scope.get(name)
+        if slot is not None and self.slots[slot] is not UNASSIGNED:
+            return self.slots[slot]
+        return super().get(name)
+    
+    def set(self, name, value):
+        slot = self.scope.get(name)
+        if slot is not None:
+            self.slots[slot] = value
+        elif self.vars is NO_VARS:
+            self.vars = {name: value}
+        else:
+            self.vars[name] = value
+    
+    def update(self, name, value):
+        slot = self.scope.get(name)
+        if slot is not None and self.slots[slot] is not UNASSIGNED:
+            self.slots[slot] = value
+        else:
+            super().update(name, value)
+    
+    def get_local(self, name):
+        slot = self.scope.get(name)
+        if slot is not None and self.slots[slot] is not UNASSIGNED:
+            return self.slots[slot]
+        return self.vars.get(name, UNASSIGNED)
+
+class Shape(dict):
+    # Hidden class for the fields of instances the Resolver did not lay out:
+    # the names set so far, each mapped to its offset in the slots. Adding a
+    # name moves to a child Shape, made once per parent, so instances of a
+    # Class that set the same names in the same order share every Shape.
+    __slots__ = ('transitions',)
+    
+    def __init__(self, offsets=()):
+        super().__init__(offsets)
+        self.transitions = {}
+    
+    def add(self, name):
+        shape = self.transitions.get(name)
+        if shape is None:
+            shape = self.transitions[name] = Shape({**self, name: len(self)})
+        return shape
+
+class ShapedEnvironment(SlotEnvironment):
+    # SlotEnvironment whose scope is a Shape that grows as names are set, so
+    # its slots never hold UNASSIGNED and nothing is kept in a dict
+    __slots__ = ()
+    
+    def __init__(self, parent, shape):
+        self.vars = NO_VARS
+        self.parent = parent
+        self.scope = shape
+        self.slots = [UNASSIGNED] * len(shape)
+    
+    def set(self, name, value):
+        slot = self.scope.get(name)
+        if slot is not None:
+            self.slots[slot] = value
+        else:
+            self.scope = self.scope.add(name)
+            self.slots.append(value)
+
+class MemberSite:
+    # Inline cache of a MemberAccess or MethodCall: the instance layout (the
+    # scope of its fields) seen last and the offset of the field in it
+    __slots__ = ('layout', 'offset')
+    
+    def __init__(self):
+        self.layout = None
+        self.offset = None
+
+def block_environment(parent, scope):
+    # Environment for running a block: a fresh one if the tree was not
+    # resolved, array-backed if the Resolver found declarations in the block,
+    # and the surrounding one if it found none
+    if scope is None:
+        return Environment(parent)
+    elif scope:
+        return SlotEnvironment(parent, scope)
+    return parent
+
+def parameters_packed(params, scope):
+    # Whether resolved parameters take the first slots of the scope in order,
+    # so a call can fill them straight from the argument list
+    return bool(params) and scope is not None and all(
+        scope.get(param) == index for index, param in enumerate(params))
+
+def parameter_environment(closure, scope, params, args, packed):
+    # Environment for a Function or Class body with its parameters bound
+    if packed:
+        env = SlotEnvironment(closure, scope)
+        env.slots[:len(args)] = args
+        return env
+    env = block_environment(closure, scope)
+    for param, arg in zip(params, args):
+        env.set(param, arg)
+    return env
 
 class Function:
-    def __init__(self, name, params, body, closure):
+    def __init__(self, name, params, body, closure, scope=None, packed=None, memo_size=None):
         self.name = name
         self.params = params
         self.body = body
         self.closure = closure
+        self.scope = scope
+        self.packed = parameters_packed(params, scope) if packed is None else packed
+        # Results of earlier calls, for a Function of a Remembrall declaration
+        self.memo = MemoCache(memo_size) if memo_size else None
+    
+    def bind(self, args):
+        # Environment for one call with the parameters bound to `args`
+        if len(args) != len(self.params):
+            raise RuntimeErrorSL(f"Function '{self.name}' expects {len(self.params)} arguments, got {len(args)}.", self.body[0])
+        return self.enter(args)
+    
+    def enter(self, args):
+        # bind() without the arity check, for a CallSite that already made it
+        return parameter_environment(self.closure, self.scope, self.params, args, self.packed)
     
     def call(self, interpreter, args):
+        memo = self.memo
+        if memo is None:
+            return interpreter.call_function(self, self.bind(args))
+        key = memo.key(args)
+        value = UNASSIGNED if key is None else memo.get(key)
+        if value is UNASSIGNED:
+            value = interpreter.call_function(self, self.bind(args))
+            if key is not None:
+                memo.put(key, value)
+        return value
+    
+    def bound_to(self, closure):
+        # This method of a Class closing over one instance's Environment
+        return Function(self.name, self.params, self.body, closure, self.scope, self.packed)
+    
+    def bind_method(self, closure, args):
+        # bound_to(closure).bind(args) without making the Function
         if len(args) != len(self.params):
             raise RuntimeErrorSL(f"Function '{self.name}' expects {len(self.params)} arguments, got {len(args)}.", self.body[0])
-        env = Environment(self.closure)
-        for param, arg in zip(self.params, args):
-            env.set(param, arg)
-        return interpreter.execute_block(self.body, env)
+        return parameter_environment(closure, self.scope, self.params, args, self.packed)
+    
+    def call_bound(self, interpreter, closure, args):
+        return interpreter.call_function(self, self.bind_method(closure, args))
 
 class Class:
-    def __init__(self, name, params, body, closure, parent=None):
+    def __init__(self, name, params, body, closure, parent=None, scope=None, methods=None, init=None):
+        # `init` is the part of `body` that runs for each instance; `methods`
+        # maps names to the FunctionDeclarations class_layout moved out of
+        # it, made into Functions here once and bound to an instance when
+        # first read
+        if parent is not None:
+            # A Bloodline declares no body of its own: its instances are built
+            # as the parent's are, with its parameters, fields and layout, so
+            # that inherited methods find their fields in the slots they were
+            # resolved against
+            params, body, closure, scope, init = parent.params, parent.body, parent.closure, parent.scope, parent.init
         self.name = name
         self.params = params
         self.body = body
+        self.init = body if init is None else init
         self.closure = closure
         self.parent = parent
+        self.scope = scope
         self.methods = {}
         self.attributes = {}
+        self.packed = parameters_packed(params, scope)
+        # Root of the instance layouts when there is no Resolver scope
+        self.shape = Shape() if parent is None else parent.shape
+        for method in (methods or {}).values():
+            self.methods[method.name] = Function(method.name, method.params, method.body, None, method.scope)
+        # Flattened method resolution table, own methods over inherited ones.
+        # A Bloodline links to the parent Class object it was declared
+        # against and method tables never change once built, so redefining
+        # a class makes new tables and leaves those of existing subclasses
+        # resolving against the old parent, as the ancestor walk did.
+        if parent is None:
+            self.vtable = self.methods
+        elif self.methods:
+            self.vtable = {**parent.vtable, **self.methods}
+        else:
+            self.vtable = parent.vtable
     
-    def call(self, interpreter, args):
+    def instantiate(self, args):
+        # A new Instance and the Environment to run `init` in for it
         if len(args) != len(self.params):
             raise RuntimeErrorSL(f"Class '{self.name}' expects {len(self.params)} arguments, got {len(args)}.", self.body[0])
-        instance = Instance(self)
-        env = Environment(self.closure)
-        for param, arg in zip(self.params, args):
-            env.set(param, arg)
-        interpreter.execute_block(self.body, env, instance)
+        if self.scope is None:
+            env = ShapedEnvironment(self.closure, self.shape)
+            for param, arg in zip(self.params, args):
+                env.set(param, arg)
+        else:
+            env = parameter_environment(self.closure, self.scope, self.params, args, self.packed)
+        return Instance(self, env), env
+    
+    def call(self, interpreter, args):
+        instance, env = self.instantiate(args)
+        interpreter.execute_block(self.init, env, instance)
         return instance
+    
+    def find_method(self, name):
+        return self.vtable.get(name)
+
+class MemoCache:
+    # Least recently used results of a Remembrall Function, by argument
+    # values and their types, so that 1 and 1.0 are kept apart. Calls with
+    # an unhashable argument, a Cauldron or SpellBook, bypass the cache and
+    # are counted as skipped.
+    __slots__ = ('size', 'results', 'hits', 'misses', 'evictions', 'skipped')
+    
+    def __init__(self, size):
+        self.size = size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.skipped = 0
+    
+    def key(self, args):
+        # The key for a call with args, or None if it cannot be cached
+        key = (*args, *map(type, args))
+        try:
+            hash(key)
+        except TypeError:
+            self.skipped += 1
+            return None
+        return key
+    
+    def get(self, key):
+        # The cached result for key, or UNASSIGNED
+        results = self.results
+        value = results.get(key, UNASSIGNED)
+        if value is UNASSIGNED:
+            self.misses += 1
+        else:
+            self.hits += 1
+            results.move_to_end(key)
+        return value
+    
+    def put(self, key, value):
+        results = self.results
+        results[key] = value
+        if len(results) > self.size:
+            results.popitem(last=False)
+            self.evictions += 1
+    
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'skipped': self.skipped, 'cached': len(self.results)}
+
+class CallSite:
+    # Monomorphic inline cache for one FunctionCall node: the callee it saw
+    # last and how to call it. While the same object comes back the engines
+    # skip the isinstance cascade and the arity check; `target` is whatever
+    # the engine runs a cached Function's body with.
+    __slots__ = ('callee', 'kind', 'target', 'hits', 'misses')
+    
+    def __init__(self):
+        self.callee = UNASSIGNED
+        self.kind = None
+        self.target = None
+        self.hits = 0
+        self.misses = 0
+    
+    def update(self, callee, arg_count):
+        self.misses += 1
+        self.callee = callee
+        self.target = None
+        if isinstance(callee, Function):
+            # Remembrall Functions go through Function.call and their cache
+            if len(callee.params) == arg_count and callee.memo is None:
+                self.kind = 'function'
+            else:
+                self.kind = 'generic'
+        elif callable(callee):
+            self.kind = 'builtin'
+        else:
+            # Classes, instances and anything else take the full cascade
+            self.kind = 'generic'
 
 class Instance:
-    def __init__(self, cls):
-        self.cls = cls
-        self.fields = {}
+    # The fields are the variables of the Environment the class body ran in,
+    # a SlotEnvironment with the Resolver's scope or a ShapedEnvironment, so
+    # instances of one Class share the layout and keep only a list of values
+    __slots__ = ('cls', 'fields', 'bound')
     
-    def get(self, name):
-        if name in self.fields:
-            return self.fields[name]
-        elif name in self.cls.methods:
-            return self.cls.methods[name]
-        else:
-            raise RuntimeErrorSL(f"Attribute or method '{name}' not found in class '{self.cls.name}'.", None)
+    def __init__(self, cls, fields):
+        self.cls = cls
+        self.fields = fields
+        # Methods bound to this instance, made on first read
+        self.bound = None
+    
+    def get(self, name, node=None):
+        value = self.fields.get_local(name)
+        if value is not UNASSIGNED:
+            return value
+        elif self.bound is not None and name in self.bound:
+            return self.bound[name]
+        method = self.cls.find_method(name)
+        if method is None:
+            raise RuntimeErrorSL(f"Attribute or method '{name}' not found in class '{self.cls.name}'.", node)
+        if self.bound is None:
+            self.bound = {}
+        bound = self.bound[name] = method.bound_to(self.fields)
+        return bound
     
     def set(self, name, value):
-        self.fields[name] = value
+        self.fields.set(name, value)
+
+class Rope:
+    # A string built by +, kept as the list of pieces appended so far and
+    # joined only when something reads the text. Ropes appended to the same
+    # rope share its list, each seeing its first `count` pieces; appending to
+    # a rope that is no longer the last one copies the list, so earlier
+    # values never change.
+    __slots__ = ('parts', 'count', 'length', 'text')
+    
+    def __init__(self, parts, length):
+        self.parts = parts
+        self.count = len(parts)
+        self.length = length
+        self.text = None
+    
+    def append(self, text):
+        parts = self.parts
+        if len(parts) != self.count:
+            parts = parts[:self.count]
+        parts.append(text)
+        return Rope(parts, self.length + len(text))
+    
+    def __str__(self):
+        text = self.text
+        if text is None:
+            parts = self.parts
+            if len(parts) != self.count:
+                parts = parts[:self.count]
+            text = self.text = ''.join(parts)
+        return text
+    
+    def __add__(self, other):
+        if type(other) is str:
+            return self.append(other)
+        elif type(other) is Rope:
+            return self.append(str(other))
+        return str(self) + other
+    
+    def __radd__(self, other):
+        return other + str(self)
+    
+    # Every other operator works on the text, so that results and error
+    # messages are those of str
+    def __sub__(self, other):
+        return str(self) - other
+    
+    def __rsub__(self, other):
+        return other - str(self)
+    
+    def __mul__(self, other):
+        return str(self) * other
+    
+    def __rmul__(self, other):
+        return other * str(self)
+    
+    def __truediv__(self, other):
+        return str(self) / other
+    
+    def __rtruediv__(self, other):
+        return other / str(self)
+    
+    def __mod__(self, other):
+        return str(self) % (str(other) if type(other) is Rope else other)
+    
+    def __rmod__(self, other):
+        return other % str(self)
+    
+    def __neg__(self):
+        return -str(self)
+    
+    def __eq__(self, other):
+        return str(self) == (str(other) if type(other) is Rope else other)
+    
+    def __ne__(self, other):
+        return str(self) != (str(other) if type(other) is Rope else other)
+    
+    def __lt__(self, other):
+        return str(self) < (str(other) if type(other) is Rope else other)
+    
+    def __le__(self, other):
+        return str(self) <= (str(other) if type(other) is Rope else other)
+    
+    def __gt__(self, other):
+        return str(self) > (str(other) if type(other) is Rope else other)
+    
+    def __ge__(self, other):
+        return str(self) >= (str(other) if type(other) is Rope else other)
+    
+    def __hash__(self):
+        return hash(str(self))
+    
+    def __len__(self):
+        return self.length
+    
+    def __int__(self):
+        return int(str(self))
+    
+    def __getitem__(self, index):
+        return str(self)[index]
+    
+    def __repr__(self):
+        return repr(str(self))
+
+def concatenate(left, right):
+    # left + right for a str left, starting a Rope when the result is long
+    # enough that copying it on every further + would dominate
+    if type(right) is str and len(left) + len(right) >= ROPE_MIN_LENGTH:
+        return Rope([left, right], len(left) + len(right))
+    return left + right
+
+def add(left, right):
+    # + for operands whose types the compilers cannot tell
+    if type(left) is str:
+        return concatenate(left, right)
+    return left + right
+
+# Output sinks for Illuminate. write() takes whole lines, newline included,
+# and flush() pushes out whatever a sink holds back. Interpreter.interpret
+# flushes when the program ends, normally or with an error.
+class BufferedSink:
+    # Joins lines and writes them to a text stream every `lines` lines: by
+    # default OUTPUT_BATCH_LINES, or each line as it comes when the stream is
+    # a terminal. Without a stream it writes to whatever sys.stdout is at the
+    # time, so redirect_stdout around interpret() captures the output.
+    def __init__(self, stream=None, lines=None):
+        self.stream = stream
+        if lines is None:
+            lines = 1 if self.target().isatty() else OUTPUT_BATCH_LINES
+        self.lines = lines
+        self.parts = []
+        if lines <= 1 and stream is not None:
+            # Nothing to hold back: lines go straight to the stream
+            self.write = stream.write
+    
+    def target(self):
+        # The stream to write to now
+        return sys.stdout if self.stream is None else self.stream
+    
+    def write(self, text):
+        parts = self.parts
+        parts.append(text)
+        if len(parts) >= self.lines:
+            self.target().write(''.join(parts))
+            parts.clear()
+    
+    def flush(self):
+        stream = self.target()
+        if self.parts:
+            stream.write(''.join(self.parts))
+            self.parts.clear()
+        stream.flush()
+    
+    def close(self):
+        self.flush()
+
+class FileSink(BufferedSink):
+    # Writes to the file at path, replacing what it held
+    def __init__(self, path, lines=OUTPUT_BATCH_LINES):
+        super().__init__(open(path, 'w'), lines)
+    
+    def close(self):
+        self.flush()
+        self.stream.close()
+
+class MemorySink:
+    # Collects the lines in memory, for getvalue()
+    def __init__(self):
+        self.parts = []
+        self.write = self.parts.append
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        pass
+    
+    def getvalue(self):
+        return ''.join(self.parts)
+
+class DispatchTable(dict):
+    # Maps a node type to the handler named prefix + type name on an Interpreter
+    # class. Each type is resolved with getattr once, then served from the dict.
+    def __init__(self, cls, prefix, fallback):
+        super().__init__()
+        self.cls = cls
+        self.prefix = prefix
+        self.fallback = fallback
+    
+    def __missing__(self, node_type):
+        handler = getattr(self.cls, self.prefix + node_type.__name__, self.fallback)
+        self[node_type] = handler
+        return handler
 
 class Interpreter:
-    def __init__(self, tree):
+    # Whether main runs the Resolver before handing this engine the tree
+    resolve_scopes = True
+    
+    def __init__(self, tree, output=None):
+        cls = type(self)
+        if 'execute_handlers' not in cls.__dict__:
+            cls.execute_handlers = DispatchTable(cls, 'execute_', cls.generic_execute)
+            cls.evaluate_handlers = DispatchTable(cls, 'evaluate_', cls.generic_evaluate)
         self.tree = tree
-        self.global_env = Environment()
+        # Where Illuminate writes: unless given, a BufferedSink on whatever
+        # standard output is when it writes
+        self.output = BufferedSink() if output is None else output
+        self.global_env = SlotEnvironment(None, tree.scope) if tree.scope else Environment()
         self.env = self.global_env
         self.functions = {}
         self.classes = {}
+        # (Function, Environment, whether its value is the caller's) of a
+        # tail call waiting for run_tail_calls
+        self.tail_call = None
+        # Value of the Accio that ended the body that ran last, until the call
+        # that ran the body takes it
+        self.return_value = None
+        # Inline caches of this interpreter by node: CallSites of FunctionCalls
+        # and MemberSites of MemberAccesses and MethodCalls. They are kept off
+        # the tree so that interpreters sharing a parsed program keep and
+        # count their own.
+        self.call_sites = {}
+        self.member_sites = {}
         self.setup_builtins()
     
     def setup_builtins(self):
@@ -687,16 +2008,22 @@ class Interpreter:
         self.global_env.set('int', int)
     
     def interpret(self):
+        # Runs the program, reporting a SpellLang error after the output
+        # Illuminated before it
         try:
-            for stmt in self.tree.statements:
-                self.execute(stmt)
+            self.run_program()
         except SpellLangError as e:
+            self.output.flush()
             print(e)
+        finally:
+            self.output.flush()
+    
+    def run_program(self):
+        for stmt in self.tree.statements:
+            self.execute(stmt)
     
     def execute(self, node):
-        method_name = f'execute_{type(node).__name__}'
-        method = getattr(self, method_name, self.generic_execute)
-        return method(node)
+        return self.execute_handlers[type(node)](self, node)
     
     def generic_execute(self, node):
         raise RuntimeErrorSL(f"No execute_{type(node).__name__} method", node)
@@ -705,21 +2032,91 @@ class Interpreter:
         for stmt in node.statements:
             self.execute(stmt)
     
+    def define(self, name, slot, value):
+        if slot is None:
+            self.env.set(name, value)
+        else:
+            self.env.slots[slot] = value
+    
     def execute_VarDeclaration(self, node):
         value = self.evaluate(node.value)
-        self.env.set(node.name, value)
+        self.define(node.name, node.slot, value)
     
     def execute_Assignment(self, node):
         value = self.evaluate(node.value)
-        self.env.update(node.name, value)
+        if node.slot is None:
+            self.env.update(node.name, value)
+        else:
+            self.env.update_at(node.depth, node.slot, node.name, value)
     
     def execute_FunctionDeclaration(self, node):
-        func = Function(node.name, node.params, node.body, self.env)
+        func = Function(node.name, node.params, node.body, self.env, node.scope, memo_size=node.memo_size)
         self.functions[node.name] = func
-        self.env.set(node.name, func)
+        self.define(node.name, node.slot, func)
+    
+    def call_site(self, node, func):
+        site = self.call_sites.get(node)
+        if site is None:
+            site = self.call_sites[node] = CallSite()
+        if func is site.callee:
+            site.hits += 1
+        else:
+            site.update(func, len(node.args))
+        return site.kind
+    
+    def call_function(self, func, env):
+        # Runs the body of func in env, which has its parameters bound, and
+        # returns the value it gives with Accio
+        self.execute_block(func.body, env)
+        if self.tail_call is not None:
+            self.run_tail_calls()
+        return self.take_return_value()
+    
+    def run_tail_calls(self):
+        # A tail call only records itself and returns, unwinding the body
+        # that made it; the call runs here, in the frame that ran that body,
+        # and so does any tail call it makes in turn. Past a Cast statement
+        # the value of the chain is None, whatever the Incantations after it
+        # give.
+        keep = True
+        while self.tail_call is not None:
+            func, env, keep_value = self.tail_call
+            self.tail_call = None
+            keep = keep and keep_value
+            self.execute_block(func.body, env)
+        if not keep:
+            self.return_value = None
+    
+    def take_return_value(self):
+        value = self.return_value
+        self.return_value = None
+        return value
+    
+    def memo_stats(self):
+        # Cache statistics of the Remembrall Incantations, by name; for one
+        # declared more than once, those of the Function made last
+        return {name: func.memo.stats() for name, func in self.functions.items()
+                if isinstance(func, Function) and func.memo is not None}
+    
+    def call_cache_stats(self):
+        # Totals over the CallSites this interpreter made for FunctionCalls it
+        # compiled or ran
+        sites = list(self.call_sites.values())
+        return {'sites': len(sites), 'hits': sum(site.hits for site in sites),
+                'misses': sum(site.misses for site in sites)}
     
     def execute_FunctionCall(self, node):
-        func = self.env.get(node.name)
+        func = self.env.get(node.name) if node.slot is None else self.env.get_at(node.depth, node.slot, node.name)
+        kind = self.call_site(node, func)
+        if kind == 'function':
+            env = func.enter([self.evaluate(arg) for arg in node.args])
+            if node.tail:
+                self.tail_call = func, env, False
+            else:
+                self.call_function(func, env)
+            return None
+        elif kind == 'builtin':
+            return func(*[self.evaluate(arg) for arg in node.args])
         if isinstance(func, Function):
             args = [self.evaluate(arg) for arg in node.args]
             return func.call(self, args)
@@ -732,33 +2129,116 @@ class Interpreter:
         else:
             raise RuntimeErrorSL(f"'{node.name}' is not a function", node)
     
+    def get_member(self, target, node):
+        if not isinstance(target, Instance):
+            raise RuntimeErrorSL(f"Cannot read '{node.name}' of a value that is not a creature", node)
+        fields = target.fields
+        site = self.member_sites.get(node)
+        if site is not None and fields.scope is site.layout:
+            value = fields.slots[site.offset]
+            if value is not UNASSIGNED:
+                return value
+        value = target.get(node.name, node)
+        offset = fields.scope.get(node.name)
+        if offset is not None and fields.slots[offset] is value:
+            if site is None:
+                site = self.member_sites[node] = MemberSite()
+            site.layout, site.offset = fields.scope, offset
+        return value
+    
+    def call_member(self, func, args, node):
+        # Calls what a MethodCall read from an instance
+        if isinstance(func, (Function, Class)):
+            return func.call(self, args)
+        elif callable(func):
+            try:
+                return func(*args)
+            except Exception as e:
+                raise RuntimeErrorSL(str(e), node)
+        raise RuntimeErrorSL(f"'{node.name}' is not a method", node)
+    
+    def lookup_method(self, target, node):
+        # The vtable method a MethodCall on target runs directly on the
+        # instance's fields, or None if there is none or a field hides it
+        if isinstance(target, Instance) and target.fields.get_local(node.name) is UNASSIGNED:
+            return target.cls.find_method(node.name)
+        return None
+    
+    def execute_MethodCall(self, node):
+        target = self.evaluate(node.target)
+        method = self.lookup_method(target, node)
+        if method is not None:
+            return method.call_bound(self, target.fields, [self.evaluate(arg) for arg in node.args])
+        func = self.get_member(target, node)
+        return self.call_member(func, [self.evaluate(arg) for arg in node.args], node)
+    
     def execute_PrintStatement(self, node):
         value = self.evaluate(node.expression)
-        print(value)
+        self.output.write(str(value) + '\n')
+    
+    def execute_ReturnStatement(self, node):
+        self.return_value = self.evaluate(node.value)
+        return RETURNED
     
     def execute_IfStatement(self, node):
         condition = self.evaluate(node.condition)
         if self.is_truthy(condition):
-            self.execute_block(node.if_body, Environment(self.env))
+            return self.execute_block(node.if_body, block_environment(self.env, node.if_scope))
         else:
-            self.execute_block(node.else_body, Environment(self.env))
+            return self.execute_block(node.else_body, block_environment(self.env, node.else_scope))
     
     def execute_WhileLoop(self, node):
         while self.is_truthy(self.evaluate(node.condition)):
-            self.execute_block(node.body, Environment(self.env))
+            if self.execute_block(node.body, block_environment(self.env, node.body_scope)) is RETURNED:
+                return RETURNED
     
     def execute_ForLoop(self, node):
         # Execute initialization
-        self.execute(node.var)
+        self.execute(node.init)
+        if node.counting is not None:
+            done = self.execute_counting_loop(node)
+            if done is RETURNED:
+                return RETURNED
+            elif done:
+                return
         while self.is_truthy(self.evaluate(node.condition)):
-            self.execute_block(node.body, Environment(self.env))
+            if self.execute_block(node.body, block_environment(self.env, node.body_scope)) is RETURNED:
+                return RETURNED
             # Execute increment
             self.execute(node.increment)
     
+    def execute_counting_loop(self, node):
+        # Runs a loop recognised by counting_loop over a Python range. Returns
+        # False to let the generic loop carry on from the current state when a
+        # call from the body assigns the counter, or the bound changes, and
+        # RETURNED when an Accio in the body ends it.
+        env = self.env
+        name, stop_node, inclusive = node.counting
+        start = env.get(name)
+        stop = self.evaluate(stop_node)
+        if type(start) is not int or type(stop) is not int:
+            return False
+        variable_stop = isinstance(stop_node, Identifier)
+        end = stop + 1 if inclusive else stop
+        for value in range(start, end):
+            env.set(name, value)
+            if self.execute_block(node.body, block_environment(env, node.body_scope)) is RETURNED:
+                return RETURNED
+            if env.get(name) is not value:
+                self.execute(node.increment)
+                return False
+            if variable_stop and self.evaluate(stop_node) is not stop:
+                env.set(name, value + 1)
+                return False
+        if end > start:
+            env.set(name, end)
+        return True
+    
     def execute_ClassDeclaration(self, node):
-        cls = Class(node.name, node.params, node.body, self.env)
+        methods, init = class_layout(node)
+        cls = Class(node.name, node.params, node.body, self.env, scope=node.scope, methods=methods, init=init)
         self.classes[node.name] = cls
-        self.env.set(node.name, cls)
+        self.define(node.name, node.slot, cls)
     
     def execute_Inheritance(self, node):
         if node.parent not in self.classes:
@@ -766,29 +2246,29 @@ class Interpreter:
         parent_cls = self.classes[node.parent]
         cls = Class(node.child, [], [], self.env, parent=parent_cls)
         self.classes[node.child] = cls
-        self.env.set(node.child, cls)
+        self.define(node.child, node.slot, cls)
     
     def execute_TryCatch(self, node):
         try:
-            self.execute_block(node.try_block, Environment(self.env))
+            return self.execute_block(node.try_block, block_environment(self.env, node.try_scope))
         except SpellLangError as e:
-            self.execute_block(node.catch_block, Environment(self.env))
+            return self.execute_block(node.catch_block, block_environment(self.env, node.catch_scope))
     
     def execute_block(self, statements, env, instance=None):
+        # Returns RETURNED if an Accio ended the block
         previous_env = self.env
         self.env = env
         if instance:
             self.env.set('self', instance)
         try:
             for stmt in statements:
-                self.execute(stmt)
+                if self.execute(stmt) is RETURNED:
+                    return RETURNED
         finally:
             self.env = previous_env
     
     def evaluate(self, node):
-        method_name = f'evaluate_{type(node).__name__}'
-        method = getattr(self, method_name, self.generic_evaluate)
-        return method(node)
+        return self.evaluate_handlers[type(node)](self, node)
     
     def generic_evaluate(self, node):
         raise RuntimeErrorSL(f"No evaluate_{type(node).__name__} method", node)
@@ -802,14 +2282,23 @@ class Interpreter:
             return node.value
     
     def evaluate_Identifier(self, node):
-        return self.env.get(node.name)
+        if node.slot is None:
+            return self.env.get(node.name)
+        return self.env.get_at(node.depth, node.slot, node.name)
     
     def evaluate_BinaryOp(self, node):
         left = self.evaluate(node.left)
-        right = self.evaluate(node.right)
         op = node.operator
+        # The right operand of && and || is only evaluated when it decides the result
+        if op == '&&':
+            return self.is_truthy(left) and self.is_truthy(self.evaluate(node.right))
+        elif op == '||':
+            return self.is_truthy(left) or self.is_truthy(self.evaluate(node.right))
+        right = self.evaluate(node.right)
         try:
             if op == '+':
+                if type(left) is str:
+                    return concatenate(left, right)
                 return left + right
             elif op == '-':
                 return left - right
@@ -831,10 +2320,6 @@ class Interpreter:
                 return left <= right
             elif op == '>=':
                 return left >= right
-            elif op == '&&':
-                return self.is_truthy(left) and self.is_truthy(right)
-            elif op == '||':
-                return self.is_truthy(left) or self.is_truthy(right)
             else:
                 raise RuntimeErrorSL(f"Unknown operator '{op}'", node)
         except Exception as e:
@@ -857,7 +2342,20 @@ class Interpreter:
         return self.execute_FunctionCall(node)
     
     def evaluate_FunctionCall(self, node):
-        func = self.env.get(node.name)
+        func = self.env.get(node.name) if node.slot is None else self.env.get_at(node.depth, node.slot, node.name)
+        kind = self.call_site(node, func)
+        if kind == 'function':
+            env = func.enter([self.evaluate(arg) for arg in node.args])
+            if node.tail:
+                self.tail_call = func, env, True
+                return None
+            return self.call_function(func, env)
+        elif kind == 'builtin':
+            args = [self.evaluate(arg) for arg in node.args]
+            try:
+                return func(*args)
+            except Exception as e:
+                raise RuntimeErrorSL(str(e), node)
         if isinstance(func, Function):
             args = [self.evaluate(arg) for arg in node.args]
             return func.call(self, args)
@@ -876,6 +2374,12 @@ class Interpreter:
         else:
             raise RuntimeErrorSL(f"'{node.name}' is not a function or class", node)
     
+    def evaluate_MemberAccess(self, node):
+        return self.get_member(self.evaluate(node.target), node)
+    
+    def evaluate_MethodCall(self, node):
+        return self.execute_MethodCall(node)
+    
     def is_truthy(self, value):
         return bool(value)
     
@@ -887,13 +2391,1381 @@ class Interpreter:
         # To be implemented for accessing dictionary elements
         pass
 
+# Binary operators with a direct Python equivalent, used by the compiled engines
+BINARY_FUNCTIONS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '%': operator.mod,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+}
+
+# Closure Compiler
+class ClosureInterpreter(Interpreter):
+    # Compiles the tree once into nested Python closures, one per node, each
+    # taking the Environment to run in. Operators and callee names are resolved
+    # at compile time; running the program is calling the root closure.
+    def __init__(self, tree, output=None):
+        super().__init__(tree, output)
+        cls = type(self)
+        if 'statement_compilers' not in cls.__dict__:
+            cls.statement_compilers = DispatchTable(cls, 'compile_', cls.compile_unknown_statement)
+            cls.expression_compilers = DispatchTable(cls, 'compile_expr_', cls.compile_unknown_expression)
+        self.blocks = {}
+        self.program = self.compile_block(tree.statements)
+    
+    def run_program(self):
+        self.program(self.global_env)
+    
+    def execute_block(self, statements, env, instance=None):
+        # Entry point for Function.call and Class.call
+        if instance:
+            env.set('self', instance)
+        self.block_for(statements)(env)
+    
+    def block_for(self, statements):
+        entry = self.blocks.get(id(statements))
+        return entry[1] if entry else self.compile_block(statements)
+    
+    def compile_call_site(self, node):
+        # A new CallSite and the function that refills it on a miss; the
+        # target of a cached Function is its compiled body
+        site = self.call_sites[node] = CallSite()
+        arg_count = len(node.args)
+        block_for = self.block_for
+        def miss(func):
+            site.update(func, arg_count)
+            if site.kind == 'function':
+                site.target = block_for(func.body)
+        return site, miss
+    
+    def compile_block(self, statements):
+        steps = tuple(self.compile_statement(stmt) for stmt in statements)
+        if len(steps) == 1:
+            block = steps[0]
+        elif contains_return(statements):
+            def block(env):
+                for step in steps:
+                    if step(env) is RETURNED:
+                        return RETURNED
+        else:
+            def block(env):
+                for step in steps:
+                    step(env)
+        # The statement list is kept alive with its closure so its id stays unique
+        self.blocks[id(statements)] = (statements, block)
+        return block
+    
+    def compile_statement(self, node):
+        return self.statement_compilers[type(node)](self, node)
+    
+    def compile_expression(self, node):
+        return self.expression_compilers[type(node)](self, node)
+    
+    def compile_unknown_statement(self, node):
+        def run(env):
+            raise RuntimeErrorSL(f"No execute_{type(node).__name__} method", node)
+        return run
+    
+    def compile_unknown_expression(self, node):
+        def run(env):
+            raise RuntimeErrorSL(f"No evaluate_{type(node).__name__} method", node)
+        return run
+    
+    # Variable access, by slot where the Resolver annotated the node
+    def compile_lookup(self, name, depth, slot):
+        if slot is None:
+            return lambda env: env.get(name)
+        elif depth == 0:
+            def lookup(env):
+                value = env.slots[slot]
+                return value if value is not UNASSIGNED else env.get_at(0, slot, name)
+        elif depth == 1:
+            def lookup(env):
+                value = env.parent.slots[slot]
+                return value if value is not UNASSIGNED else env.get_at(1, slot, name)
+        else:
+            def lookup(env):
+                return env.get_at(depth, slot, name)
+        return lookup
+    
+    def compile_define(self, name, slot):
+        if slot is None:
+            return lambda env, value: env.set(name, value)
+        def define(env, value):
+            env.slots[slot] = value
+        return define
+    
+    def compile_scoped_block(self, statements, scope):
+        # A block together with the Environment it runs in, see block_environment
+        block = self.compile_block(statements)
+        if scope is None:
+            return lambda env: block(Environment(env))
+        elif scope:
+            return lambda env: block(SlotEnvironment(env, scope))
+        return block
+    
+    # Statements
+    def compile_VarDeclaration(self, node):
+        name, slot = node.name, node.slot
+        value = self.compile_expression(node.value)
+        if slot is None:
+            def run(env):
+                env.set(name, value(env))
+        else:
+            def run(env):
+                env.slots[slot] = value(env)
+        return run
+    
+    def compile_Assignment(self, node):
+        name, depth, slot = node.name, node.depth, node.slot
+        value = self.compile_expression(node.value)
+        if slot is None:
+            def run(env):
+                env.update(name, value(env))
+        else:
+            def run(env):
+                env.update_at(depth, slot, name, value(env))
+        return run
+    
+    def compile_FunctionDeclaration(self, node):
+        name, params, body, scope, memo_size = node.name, node.params, node.body, node.scope, node.memo_size
+        functions = self.functions
+        define = self.compile_define(name, node.slot)
+        self.compile_block(body)
+        def run(env):
+            func = Function(name, params, body, env, scope, memo_size=memo_size)
+            functions[name] = func
+            define(env, func)
+        return run
+    
+    def compile_FunctionCall(self, node):
+        name = node.name
+        lookup = self.compile_lookup(name, node.depth, node.slot)
+        args = tuple(self.compile_expression(arg) for arg in node.args)
+        site, miss = self.compile_call_site(node)
+        tail = node.tail
+        interpreter = self
+        def run(env):
+            func = lookup(env)
+            if func is site.callee:
+                site.hits += 1
+            else:
+                miss(func)
+            if site.kind == 'function':
+                callee_env = func.enter([arg(env) for arg in args])
+                if tail:
+                    interpreter.tail_call = func, callee_env, False
+                    return None
+                site.target(callee_env)
+                if interpreter.tail_call is not None:
+                    interpreter.run_tail_calls()
+                interpreter.return_value = None
+                return None
+            elif site.kind == 'builtin':
+                return func(*[arg(env) for arg in args])
+            if isinstance(func, Function):
+                return func.call(interpreter, [arg(env) for arg in args])
+            elif callable(func):
+                return func(*[arg(env) for arg in args])
+            elif isinstance(func, Instance):
+                pass
+            else:
+                raise RuntimeErrorSL(f"'{name}' is not a function", node)
+        return run
+    
+    def compile_MethodCall(self, node):
+        target = self.compile_expression(node.target)
+        args = tuple(self.compile_expression(arg) for arg in node.args)
+        lookup_method, get_member, call_member = self.lookup_method, self.get_member, self.call_member
+        interpreter = self
+        def run(env):
+            instance = target(env)
+            method = lookup_method(instance, node)
+            if method is not None:
+                return method.call_bound(interpreter, instance.fields, [arg(env) for arg in args])
+            func = get_member(instance, node)
+            return call_member(func, [arg(env) for arg in args], node)
+        return run
+    
+    def compile_PrintStatement(self, node):
+        expression = self.compile_expression(node.expression)
+        output = self.output
+        def run(env):
+            output.write(str(expression(env)) + '\n')
+        return run
+    
+    def compile_ReturnStatement(self, node):
+        value = self.compile_expression(node.value)
+        interpreter = self
+        def run(env):
+            interpreter.return_value = value(env)
+            return RETURNED
+        return run
+    
+    def compile_IfStatement(self, node):
+        condition = self.compile_expression(node.condition)
+        if_body = self.compile_scoped_block(node.if_body, node.if_scope)
+        else_body = self.compile_scoped_block(node.else_body, node.else_scope)
+        is_truthy = self.is_truthy
+        def run(env):
+            if is_truthy(condition(env)):
+                return if_body(env)
+            else:
+                return else_body(env)
+        return run
+    
+    def compile_WhileLoop(self, node):
+        condition = self.compile_expression(node.condition)
+        body = self.compile_scoped_block(node.body, node.body_scope)
+        is_truthy = self.is_truthy
+        def run(env):
+            while is_truthy(condition(env)):
+                if body(env) is RETURNED:
+                    return RETURNED
+        return run
+    
+    def compile_ForLoop(self, node):
+        init = self.compile_statement(node.init)
+        condition = self.compile_expression(node.condition)
+        increment = self.compile_statement(node.increment)
+        body = self.compile_scoped_block(node.body, node.body_scope)
+        is_truthy = self.is_truthy
+        if node.counting is None:
+            def run(env):
+                init(env)
+                while is_truthy(condition(env)):
+                    if body(env) is RETURNED:
+                        return RETURNED
+                    increment(env)
+            return run
+        # Counting loop, as in Interpreter.execute_counting_loop
+        name, stop_node, inclusive = node.counting
+        counter = self.compile_lookup(name, 0, node.init.slot)
+        set_counter = self.compile_define(name, node.init.slot)
+        stop_value = self.compile_expression(stop_node)
+        variable_stop = isinstance(stop_node, Identifier)
+        def run(env):
+            init(env)
+            start = counter(env)
+            stop = stop_value(env)
+            if type(start) is int and type(stop) is int:
+                end = stop + 1 if inclusive else stop
+                for value in range(start, end):
+                    set_counter(env, value)
+                    if body(env) is RETURNED:
+                        return RETURNED
+                    if counter(env) is not value:
+                        increment(env)
+                        break
+                    if variable_stop and stop_value(env) is not stop:
+                        set_counter(env, value + 1)
+                        break
+                else:
+                    if end > start:
+                        set_counter(env, end)
+                    return
+            while is_truthy(condition(env)):
+                if body(env) is RETURNED:
+                    return RETURNED
+                increment(env)
+        return run
+    
+    def compile_ClassDeclaration(self, node):
+        name, params, body, scope = node.name, node.params, node.body, node.scope
+        methods, init = class_layout(node)
+        classes = self.classes
+        define = self.compile_define(name, node.slot)
+        self.compile_block(init)
+        for method in methods.values():
+            self.compile_block(method.body)
+        def run(env):
+            cls = Class(name, params, body, env, scope=scope, methods=methods, init=init)
+            classes[name] = cls
+            define(env, cls)
+        return run
+    
+    def compile_Inheritance(self, node):
+        child, parent = node.child, node.parent
+        classes = self.classes
+        define = self.compile_define(child, node.slot)
+        def run(env):
+            if parent not in classes:
+                raise RuntimeErrorSL(f"Parent class '{parent}' not found.", node)
+            cls = Class(child, [], [], env, parent=classes[parent])
+            classes[child] = cls
+            define(env, cls)
+        return run
+    
+    def compile_TryCatch(self, node):
+        try_block = self.compile_scoped_block(node.try_block, node.try_scope)
+        catch_block = self.compile_scoped_block(node.catch_block, node.catch_scope)
+        def run(env):
+            try:
+                return try_block(env)
+            except SpellLangError:
+                return catch_block(env)
+        return run
+    
+    # Expressions
+    def compile_expr_Literal(self, node):
+        value = node.value
+        if isinstance(value, list):
+            items = tuple(self.compile_expression(item) for item in value)
+            return lambda env: [item(env) for item in items]
+        elif isinstance(value, dict):
+            pairs = tuple((self.compile_expression(k), self.compile_expression(v)) for k, v in value.items())
+            return lambda env: {k(env): v(env) for k, v in pairs}
+        return lambda env: value
+    
+    def compile_expr_Identifier(self, node):
+        return self.compile_lookup(node.name, node.depth, node.slot)
+    
+    def compile_expr_BinaryOp(self, node):
+        left = self.compile_expression(node.left)
+        right = self.compile_expression(node.right)
+        op = node.operator
+        is_truthy = self.is_truthy
+        if op == '&&':
+            return lambda env: is_truthy(left(env)) and is_truthy(right(env))
+        elif op == '||':
+            return lambda env: is_truthy(left(env)) or is_truthy(right(env))
+        elif op == '+':
+            def run(env):
+                a = left(env)
+                b = right(env)
+                try:
+                    if type(a) is str:
+                        return concatenate(a, b)
+                    return a + b
+                except Exception as e:
+                    raise RuntimeErrorSL(str(e), node)
+            return run
+        elif op in BINARY_FUNCTIONS:
+            function = BINARY_FUNCTIONS[op]
+        else:
+            def function(a, b):
+                raise RuntimeErrorSL(f"Unknown operator '{op}'", node)
+        def run(env):
+            a = left(env)
+            b = right(env)
+            try:
+                return function(a, b)
+            except Exception as e:
+                raise RuntimeErrorSL(str(e), node)
+        return run
+    
+    def compile_expr_UnaryOp(self, node):
+        operand = self.compile_expression(node.operand)
+        op = node.operator
+        is_truthy = self.is_truthy
+        if op == '-':
+            function = operator.neg
+        elif op == '!':
+            function = lambda a: not is_truthy(a)
+        else:
+            def function(a):
+                raise RuntimeErrorSL(f"Unknown unary operator '{op}'", node)
+        def run(env):
+            a = operand(env)
+            try:
+                return function(a)
+            except Exception as e:
+                raise RuntimeErrorSL(str(e), node)
+        return run
+    
+    def compile_expr_FunctionCall(self, node):
+        name = node.name
+        lookup = self.compile_lookup(name, node.depth, node.slot)
+        args = tuple(self.compile_expression(arg) for arg in node.args)
+        site, miss = self.compile_call_site(node)
+        tail = node.tail
+        interpreter = self
+        def run(env):
+            func = lookup(env)
+            if func is site.callee:
+                site.hits += 1
+            else:
+                miss(func)
+            if site.kind == 'function':
+                callee_env = func.enter([arg(env) for arg in args])
+                if tail:
+                    interpreter.tail_call = func, callee_env, True
+                    return None
+                site.target(callee_env)
+                if interpreter.tail_call is not None:
+                    interpreter.run_tail_calls()
+                value = interpreter.return_value
+                interpreter.return_value = None
+                return value
+            elif site.kind == 'builtin':
+                values = [arg(env) for arg in args]
+                try:
+                    return func(*values)
+                except Exception as e:
+                    raise RuntimeErrorSL(str(e), node)
+            if isinstance(func, Function):
+                return func.call(interpreter, [arg(env) for arg in args])
+            elif callable(func):
+                values = [arg(env) for arg in args]
+                try:
+                    return func(*values)
+                except Exception as e:
+                    raise RuntimeErrorSL(str(e), node)
+            elif isinstance(func, Class):
+                return func.call(interpreter, [arg(env) for arg in args])
+            elif isinstance(func, Instance):
+                pass
+            else:
+                raise RuntimeErrorSL(f"'{name}' is not a function or class", node)
+        return run
+    
+    def compile_expr_MemberAccess(self, node):
+        target = self.compile_expression(node.target)
+        get_member = self.get_member
+        return lambda env: get_member(target(env), node)
+    
+    def compile_expr_MethodCall(self, node):
+        return self.compile_MethodCall(node)
+
+# Explicit-Stack Interpreter
+class StackInterpreter(Interpreter):
+    # Walks the tree like Interpreter, but without Python recursion. Each node
+    # is handled by a generator that yields what it needs evaluated, an
+    # expression node or the generator of a statement or block, and is sent
+    # back the result. drive() keeps the suspended generators on a list, so
+    # how deep SpellLang calls and expressions nest is bounded by memory
+    # rather than by the recursion limit. An error is thrown into the
+    # suspended generators from the innermost outwards, which is how
+    # Protego sees it.
+    #
+    # Subtrees that make no call and nest at most direct_height levels
+    # cannot recurse far, and run on the ordinary Interpreter methods. The
+    # steps handle every call themselves, so Function.call and Class.call,
+    # which would recurse through execute_block, are not used.
+    direct_height = 32
+    
+    def __init__(self, tree, output=None):
+        cls = type(self)
+        if 'statement_steps' not in cls.__dict__:
+            cls.statement_steps = DispatchTable(cls, 'step_', cls.step_unknown)
+            cls.expression_steps = DispatchTable(cls, 'step_expr_', cls.step_expr_unknown)
+        super().__init__(tree, output)
+        self.direct = direct_nodes(tree, self.direct_height)
+    
+    def run_program(self):
+        self.drive(self.step_statements(self.tree.statements))
+    
+    def drive(self, root):
+        stack = [root]
+        expression_steps = self.expression_steps
+        direct = self.direct
+        value = None
+        error = None
+        while True:
+            generator = stack[-1]
+            try:
+                if error is None:
+                    child = generator.send(value)
+                else:
+                    thrown, error = error, None
+                    child = generator.throw(thrown)
+            except StopIteration as stop:
+                stack.pop()
+                if not stack:
+                    return stop.value
+                value = stop.value
+                continue
+            except SpellLangError as e:
+                stack.pop()
+                if not stack:
+                    raise
+                error = e
+                continue
+            if isinstance(child, ASTNode):
+                if id(child) in direct:
+                    try:
+                        value = self.evaluate(child)
+                    except SpellLangError as e:
+                        error = e
+                    continue
+                child = expression_steps[type(child)](self, child)
+            stack.append(child)
+            value = None
+    
+    def step_statements(self, statements):
+        direct = self.direct
+        for stmt in statements:
+            if id(stmt) in direct:
+                self.execute(stmt)
+            else:
+                yield self.statement_steps[type(stmt)](self, stmt)
+    
+    def step_block(self, statements, env, instance=None):
+        previous_env = self.env
+        self.env = env
+        if instance:
+            env.set('self', instance)
+        direct = self.direct
+        try:
+            for stmt in statements:
+                if id(stmt) in direct:
+                    if self.execute(stmt) is RETURNED:
+                        return RETURNED
+                elif (yield self.statement_steps[type(stmt)](self, stmt)) is RETURNED:
+                    return RETURNED
+        finally:
+            self.env = previous_env
+    
+    def step_memoized(self, func, args):
+        # Function.call of a Remembrall Function, see there
+        memo = func.memo
+        key = memo.key(args)
+        value = UNASSIGNED if key is None else memo.get(key)
+        if value is UNASSIGNED:
+            yield self.step_block(func.body, func.bind(args))
+            if self.tail_call is not None:
+                yield self.step_tail_calls()
+            value = self.take_return_value()
+            if key is not None:
+                memo.put(key, value)
+        return value
+    
+    def step_tail_calls(self):
+        # run_tail_calls, see there
+        keep = True
+        while self.tail_call is not None:
+            func, env, keep_value = self.tail_call
+            self.tail_call = None
+            keep = keep and keep_value
+            yield self.step_block(func.body, env)
+        if not keep:
+            self.return_value = None
+    
+    def step_values(self, nodes):
+        values = []
+        for node in nodes:
+            values.append((yield node))
+        return values
+    
+    def step_unknown(self, node):
+        raise RuntimeErrorSL(f"No execute_{type(node).__name__} method", node)
+        yield
+    
+    def step_expr_unknown(self, node):
+        raise RuntimeErrorSL(f"No evaluate_{type(node).__name__} method", node)
+        yield
+    
+    # Statements
+    def step_VarDeclaration(self, node):
+        value = yield node.value
+        self.define(node.name, node.slot, value)
+    
+    def step_Assignment(self, node):
+        value = yield node.value
+        if node.slot is None:
+            self.env.update(node.name, value)
+        else:
+            self.env.update_at(node.depth, node.slot, node.name, value)
+    
+    def step_FunctionDeclaration(self, node):
+        self.execute_FunctionDeclaration(node)
+        yield from ()
+    
+    def step_FunctionCall(self, node, statement=True):
+        func = self.env.get(node.name) if node.slot is None else self.env.get_at(node.depth, node.slot, node.name)
+        kind = self.call_site(node, func)
+        if kind == 'function':
+            args = yield from self.step_values(node.args)
+            env = func.enter(args)
+            if node.tail:
+                self.tail_call = func, env, not statement
+                return None
+            yield self.step_block(func.body, env)
+            if self.tail_call is not None:
+                yield self.step_tail_calls()
+            return self.take_return_value()
+        elif kind != 'builtin':
+            if isinstance(func, Function):
+                args = yield from self.step_values(node.args)
+                if func.memo is not None:
+                    return (yield self.step_memoized(func, args))
+                yield self.step_block(func.body, func.bind(args))
+                if self.tail_call is not None:
+                    yield self.step_tail_calls()
+                return self.take_return_value()
+            elif not statement and isinstance(func, Class):
+                args = yield from self.step_values(node.args)
+                instance, env = func.instantiate(args)
+                yield self.step_block(func.init, env, instance)
+                return instance
+            elif isinstance(func, Instance):
+                return None
+            elif not callable(func):
+                if statement:
+                    raise RuntimeErrorSL(f"'{node.name}' is not a function", node)
+                raise RuntimeErrorSL(f"'{node.name}' is not a function or class", node)
+        args = yield from self.step_values(node.args)
+        if statement:
+            return func(*args)
+        try:
+            return func(*args)
+        except Exception as e:
+            raise RuntimeErrorSL(str(e), node)
+    
+    def step_MethodCall(self, node):
+        target = yield node.target
+        method = self.lookup_method(target, node)
+        if method is not None:
+            args = yield from self.step_values(node.args)
+            yield self.step_block(method.body, method.bind_method(target.fields, args))
+            if self.tail_call is not None:
+                yield self.step_tail_calls()
+            return self.take_return_value()
+        func = self.get_member(target, node)
+        args = yield from self.step_values(node.args)
+        if isinstance(func, Function):
+            if func.memo is not None:
+                return (yield self.step_memoized(func, args))
+            yield self.step_block(func.body, func.bind(args))
+            if self.tail_call is not None:
+                yield self.step_tail_calls()
+            return self.take_return_value()
+        elif isinstance(func, Class):
+            instance, env = func.instantiate(args)
+            yield self.step_block(func.init, env, instance)
+            return instance
+        return self.call_member(func, args, node)
+    
+    def step_PrintStatement(self, node):
+        self.output.write(str((yield node.expression)) + '\n')
+    
+    def step_ReturnStatement(self, node):
+        self.return_value = yield node.value
+        return RETURNED
+    
+    def step_IfStatement(self, node):
+        if self.is_truthy((yield node.condition)):
+            return (yield self.step_block(node.if_body, block_environment(self.env, node.if_scope)))
+        else:
+            return (yield self.step_block(node.else_body, block_environment(self.env, node.else_scope)))
+    
+    def step_WhileLoop(self, node):
+        while self.is_truthy((yield node.condition)):
+            if (yield self.step_block(node.body, block_environment(self.env, node.body_scope))) is RETURNED:
+                return RETURNED
+    
+    def step_ForLoop(self, node):
+        yield self.statement_steps[type(node.init)](self, node.init)
+        if node.counting is not None:
+            done = yield self.step_counting_loop(node)
+            if done is RETURNED:
+                return RETURNED
+            elif done:
+                return
+        while self.is_truthy((yield node.condition)):
+            if (yield self.step_block(node.body, block_environment(self.env, node.body_scope))) is RETURNED:
+                return RETURNED
+            yield self.statement_steps[type(node.increment)](self, node.increment)
+    
+    def step_counting_loop(self, node):
+        # execute_counting_loop, see there
+        env = self.env
+        name, stop_node, inclusive = node.counting
+        start = env.get(name)
+        stop = yield stop_node
+        if type(start) is not int or type(stop) is not int:
+            return False
+        variable_stop = isinstance(stop_node, Identifier)
+        end = stop + 1 if inclusive else stop
+        for value in range(start, end):
+            env.set(name, value)
+            if (yield self.step_block(node.body, block_environment(env, node.body_scope))) is RETURNED:
+                return RETURNED
+            if env.get(name) is not value:
+                yield self.statement_steps[type(node.increment)](self, node.increment)
+                return False
+            if variable_stop and (yield stop_node) is not stop:
+                env.set(name, value + 1)
+                return False
+        if end > start:
+            env.set(name, end)
+        return True
+    
+    def step_ClassDeclaration(self, node):
+        self.execute_ClassDeclaration(node)
+        yield from ()
+    
+    def step_Inheritance(self, node):
+        self.execute_Inheritance(node)
+        yield from ()
+    
+    def step_TryCatch(self, node):
+        try:
+            return (yield self.step_block(node.try_block, block_environment(self.env, node.try_scope)))
+        except SpellLangError:
+            return (yield self.step_block(node.catch_block, block_environment(self.env, node.catch_scope)))
+    
+    # Expressions
+    def step_expr_Literal(self, node):
+        if isinstance(node.value, list):
+            return (yield from self.step_values(node.value))
+        elif isinstance(node.value, dict):
+            items = {}
+            for k, v in node.value.items():
+                key = yield k
+                items[key] = yield v
+            return items
+        return node.value
+    
+    def step_expr_Identifier(self, node):
+        return self.evaluate_Identifier(node)
+        yield
+    
+    def step_expr_BinaryOp(self, node):
+        left = yield node.left
+        op = node.operator
+        if op == '&&':
+            return self.is_truthy(left) and self.is_truthy((yield node.right))
+        elif op == '||':
+            return self.is_truthy(left) or self.is_truthy((yield node.right))
+        right = yield node.right
+        if op == '+' and type(left) is str:
+            function = concatenate
+        else:
+            function = BINARY_FUNCTIONS.get(op)
+        if function is None:
+            raise RuntimeErrorSL(f"Unknown operator '{op}'", node)
+        try:
+            return function(left, right)
+        except Exception as e:
+            raise RuntimeErrorSL(str(e), node)
+    
+    def step_expr_UnaryOp(self, node):
+        operand = yield node.operand
+        op = node.operator
+        if op == '-':
+            try:
+                return -operand
+            except Exception as e:
+                raise RuntimeErrorSL(str(e), node)
+        elif op == '!':
+            return not self.is_truthy(operand)
+        raise RuntimeErrorSL(f"Unknown unary operator '{op}'", node)
+    
+    def step_expr_FunctionCall(self, node):
+        return (yield from self.step_FunctionCall(node, statement=False))
+    
+    def step_expr_MemberAccess(self, node):
+        return self.get_member((yield node.target), node)
+    
+    def step_expr_MethodCall(self, node):
+        return (yield from self.step_MethodCall(node))
+
+# Bytecode
+OPCODE_NAMES = (
+    'LOAD_CONST', 'LOAD_NAME', 'DEFINE_NAME', 'STORE_NAME', 'BINARY_OP', 'UNARY_OP',
+    'BUILD_LIST', 'BUILD_DICT', 'LOAD_CALLEE', 'CALL', 'LOAD_MEMBER', 'LOAD_METHOD', 'PRINT',
+    'JUMP', 'JUMP_IF_FALSE', 'PUSH_SCOPE', 'POP_SCOPE', 'SETUP_TRY', 'POP_TRY',
+    'MAKE_FUNCTION', 'MAKE_CLASS', 'MAKE_SUBCLASS', 'FAIL', 'RETURN', 'RETURN_VALUE',
+    # Binary operators whose operands are read straight from a name or a constant
+    # rather than from the stack
+    'BINARY_NAME_CONST', 'BINARY_NAME_NAME', 'BINARY_STACK_CONST', 'BINARY_STACK_NAME',
+)
+(LOAD_CONST, LOAD_NAME, DEFINE_NAME, STORE_NAME, BINARY_OP, UNARY_OP,
+ BUILD_LIST, BUILD_DICT, LOAD_CALLEE, CALL, LOAD_MEMBER, LOAD_METHOD, PRINT,
+ JUMP, JUMP_IF_FALSE, PUSH_SCOPE, POP_SCOPE, SETUP_TRY, POP_TRY,
+ MAKE_FUNCTION, MAKE_CLASS, MAKE_SUBCLASS, FAIL, RETURN, RETURN_VALUE,
+ BINARY_NAME_CONST, BINARY_NAME_NAME, BINARY_STACK_CONST, BINARY_STACK_NAME) = range(len(OPCODE_NAMES))
+
+class CodeObject:
+    # One compiled statement list. Instructions are (opcode, operand) pairs; the
+    # operand is stored inline: a constant, a name, a jump target, a count, or a
+    # tuple carrying what the opcode needs at run time.
+    __slots__ = ('name', 'instructions', 'children')
+
+    def __init__(self, name, instructions, children):
+        self.name = name
+        self.instructions = instructions
+        self.children = children
+
+class BytecodeCompiler:
+    def __init__(self, is_truthy, call_sites=None):
+        self.is_truthy = is_truthy
+        # FunctionCall node -> the CallSite compiled into its CALL
+        self.call_sites = {} if call_sites is None else call_sites
+        # id(statement list) -> (statement list, CodeObject)
+        self.codes = {}
+        cls = type(self)
+        if 'statement_compilers' not in cls.__dict__:
+            cls.statement_compilers = DispatchTable(cls, 'compile_', cls.compile_unknown_statement)
+            cls.expression_compilers = DispatchTable(cls, 'compile_expr_', cls.compile_unknown_expression)
+    
+    def compile_block(self, statements, name='<program>'):
+        outer = getattr(self, 'instructions', None), getattr(self, 'children', None)
+        self.instructions = []
+        self.children = []
+        try:
+            for stmt in statements:
+                self.compile_statement(stmt)
+            self.emit(RETURN)
+            code = CodeObject(name, self.instructions, self.children)
+        finally:
+            self.instructions, self.children = outer
+        self.codes[id(statements)] = (statements, code)
+        if self.children is not None:
+            self.children.append(code)
+        return code
+    
+    def emit(self, opcode, operand=None):
+        self.instructions.append((opcode, operand))
+        return len(self.instructions) - 1
+    
+    def patch(self, index, operand):
+        self.instructions[index] = (self.instructions[index][0], operand)
+    
+    def here(self):
+        return len(self.instructions)
+    
+    def compile_statement(self, node):
+        self.statement_compilers[type(node)](self, node)
+    
+    def compile_expression(self, node):
+        self.expression_compilers[type(node)](self, node)
+    
+    def compile_scope(self, statements):
+        # Blocks run in a fresh Environment, as in Interpreter.execute_block,
+        # unless they declare nothing that could live in it
+        if any(declared_name(stmt) is not None for stmt in statements):
+            self.emit(PUSH_SCOPE)
+            for stmt in statements:
+                self.compile_statement(stmt)
+            self.emit(POP_SCOPE)
+        else:
+            for stmt in statements:
+                self.compile_statement(stmt)
+    
+    def compile_unknown_statement(self, node):
+        self.emit(FAIL, (f"No execute_{type(node).__name__} method", node))
+    
+    def compile_unknown_expression(self, node):
+        self.emit(FAIL, (f"No evaluate_{type(node).__name__} method", node))
+    
+    # Statements
+    def compile_VarDeclaration(self, node):
+        self.compile_expression(node.value)
+        self.emit(DEFINE_NAME, node.name)
+    
+    def compile_Assignment(self, node):
+        self.compile_expression(node.value)
+        self.emit(STORE_NAME, node.name)
+    
+    def compile_FunctionDeclaration(self, node):
+        self.compile_block(node.body, node.name)
+        self.emit(MAKE_FUNCTION, (node.name, node.params, node.body, node.memo_size))
+    
+    def compile_FunctionCall(self, node, statement=True):
+        callee = self.emit(LOAD_CALLEE)
+        for arg in node.args:
+            self.compile_expression(arg)
+        # Statement calls discard their result instead of pushing it
+        site = self.call_sites[node] = CallSite()
+        self.emit(CALL, (len(node.args), node, statement, site, node.tail))
+        # An Instance callee skips its arguments and the call, yielding None
+        self.patch(callee, (node.name, node, statement, self.here(), site))
+    
+    def compile_PrintStatement(self, node):
+        self.compile_expression(node.expression)
+        self.emit(PRINT)
+    
+    def compile_ReturnStatement(self, node):
+        self.compile_expression(node.value)
+        self.emit(RETURN_VALUE)
+    
+    def compile_IfStatement(self, node):
+        self.compile_expression(node.condition)
+        jump_to_else = self.emit(JUMP_IF_FALSE)
+        self.compile_scope(node.if_body)
+        if node.else_body:
+            jump_to_end = self.emit(JUMP)
+            self.patch(jump_to_else, self.here())
+            self.compile_scope(node.else_body)
+            self.patch(jump_to_end, self.here())
+        else:
+            self.patch(jump_to_else, self.here())
+    
+    def compile_WhileLoop(self, node):
+        top = self.here()
+        self.compile_expression(node.condition)
+        exit_jump = self.emit(JUMP_IF_FALSE)
+        self.compile_scope(node.body)
+        self.emit(JUMP, top)
+        self.patch(exit_jump, self.here())
+    
+    def compile_ForLoop(self, node):
+        self.compile_statement(node.init)
+        top = self.here()
+        self.compile_expression(node.condition)
+        exit_jump = self.emit(JUMP_IF_FALSE)
+        self.compile_scope(node.body)
+        self.compile_statement(node.increment)
+        self.emit(JUMP, top)
+        self.patch(exit_jump, self.here())
+    
+    def compile_ClassDeclaration(self, node):
+        methods, init = class_layout(node)
+        self.compile_block(init, node.name)
+        for method in methods.values():
+            self.compile_block(method.body, f"{node.name}.{method.name}")
+        self.emit(MAKE_CLASS, (node.name, node.params, node.body, methods, init))
+    
+    def compile_MethodCall(self, node, statement=True):
+        self.compile_expression(node.target)
+        self.emit(LOAD_METHOD, node)
+        for arg in node.args:
+            self.compile_expression(arg)
+        self.emit(CALL, (len(node.args), node, statement, CallSite(), False))
+    
+    def compile_Inheritance(self, node):
+        self.emit(MAKE_SUBCLASS, (node.child, node.parent, node))
+    
+    def compile_TryCatch(self, node):
+        setup = self.emit(SETUP_TRY)
+        self.compile_scope(node.try_block)
+        self.emit(POP_TRY)
+        jump_to_end = self.emit(JUMP)
+        self.patch(setup, self.here())
+        self.compile_scope(node.catch_block)
+        self.patch(jump_to_end, self.here())
+    
+    # Expressions
+    def compile_expr_Literal(self, node):
+        value = node.value
+        if isinstance(value, list):
+            for item in value:
+                self.compile_expression(item)
+            self.emit(BUILD_LIST, len(value))
+        elif isinstance(value, dict):
+            for k, v in value.items():
+                self.compile_expression(k)
+                self.compile_expression(v)
+            self.emit(BUILD_DICT, len(value))
+        else:
+            self.emit(LOAD_CONST, value)
+    
+    def compile_expr_Identifier(self, node):
+        self.emit(LOAD_NAME, node.name)
+    
+    def compile_expr_BinaryOp(self, node):
+        left, right = node.left, node.right
+        op = node.operator
+        if op in ('&&', '||'):
+            self.compile_logical(node)
+            return
+        elif op == '+':
+            # + with a constant that is not a string never starts a Rope, so
+            # it skips the type test of add
+            if any(self.is_constant(operand) and type(operand.value) is not str for operand in (left, right)):
+                function = operator.add
+            else:
+                function = add
+        elif op in BINARY_FUNCTIONS:
+            function = BINARY_FUNCTIONS[op]
+        else:
+            def function(a, b):
+                raise RuntimeErrorSL(f"Unknown operator '{op}'", node)
+        if isinstance(left, Identifier):
+            if self.is_constant(right):
+                self.emit(BINARY_NAME_CONST, (function, node, left.name, right.value))
+                return
+            if isinstance(right, Identifier):
+                self.emit(BINARY_NAME_NAME, (function, node, left.name, right.name))
+                return
+        self.compile_expression(left)
+        if self.is_constant(right):
+            self.emit(BINARY_STACK_CONST, (function, node, right.value))
+        elif isinstance(right, Identifier):
+            self.emit(BINARY_STACK_NAME, (function, node, right.name))
+        else:
+            self.compile_expression(right)
+            self.emit(BINARY_OP, (function, node))
+    
+    def compile_logical(self, node):
+        # && and || push True or False, jumping over the right operand when
+        # the left one already decides the result
+        self.compile_expression(node.left)
+        left_false = self.emit(JUMP_IF_FALSE)
+        if node.operator == '||':
+            self.emit(LOAD_CONST, True)
+            left_true = self.emit(JUMP)
+            self.patch(left_false, self.here())
+        self.compile_expression(node.right)
+        right_false = self.emit(JUMP_IF_FALSE)
+        self.emit(LOAD_CONST, True)
+        done = self.emit(JUMP)
+        self.patch(right_false, self.here())
+        if node.operator == '&&':
+            self.patch(left_false, self.here())
+        self.emit(LOAD_CONST, False)
+        self.patch(done, self.here())
+        if node.operator == '||':
+            self.patch(left_true, self.here())
+    
+    def is_constant(self, node):
+        return isinstance(node, Literal) and not isinstance(node.value, (list, dict))
+    
+    def compile_expr_UnaryOp(self, node):
+        self.compile_expression(node.operand)
+        op = node.operator
+        is_truthy = self.is_truthy
+        if op == '-':
+            function = operator.neg
+        elif op == '!':
+            function = lambda a: not is_truthy(a)
+        else:
+            def function(a):
+                raise RuntimeErrorSL(f"Unknown unary operator '{op}'", node)
+        self.emit(UNARY_OP, (function, node))
+    
+    def compile_expr_FunctionCall(self, node):
+        self.compile_FunctionCall(node, statement=False)
+    
+    def compile_expr_MemberAccess(self, node):
+        self.compile_expression(node.target)
+        self.emit(LOAD_MEMBER, node)
+    
+    def compile_expr_MethodCall(self, node):
+        self.compile_MethodCall(node, statement=False)
+
+def disassemble(code, lines=None):
+    # Returns a listing of `code` followed by the code of its nested bodies
+    lines = [] if lines is None else lines
+    lines.append(f"== {code.name} ==")
+    for index, (opcode, operand) in enumerate(code.instructions):
+        if opcode in (BINARY_OP, UNARY_OP):
+            detail = operand[1].operator
+        elif opcode == BINARY_NAME_CONST:
+            detail = f"{operand[2]} {operand[1].operator} {operand[3]!r}"
+        elif opcode == BINARY_NAME_NAME:
+            detail = f"{operand[2]} {operand[1].operator} {operand[3]}"
+        elif opcode == BINARY_STACK_CONST:
+            detail = f"{operand[1].operator} {operand[2]!r}"
+        elif opcode == BINARY_STACK_NAME:
+            detail = f"{operand[1].operator} {operand[2]}"
+        elif opcode == LOAD_CALLEE:
+            detail = f"{operand[0]} (instance -> {operand[3]})"
+        elif opcode == CALL:
+            detail = f"{operand[0]} args" + (" (tail)" if operand[4] else " (statement)" if operand[2] else "")
+        elif opcode in (LOAD_MEMBER, LOAD_METHOD):
+            detail = operand.name
+        elif opcode in (MAKE_FUNCTION, MAKE_CLASS):
+            detail = f"{operand[0]}({', '.join(operand[1])})"
+        elif opcode == MAKE_SUBCLASS:
+            detail = f"{operand[0]} Bloodline {operand[1]}"
+        elif opcode == FAIL:
+            detail = operand[0]
+        elif operand is None:
+            detail = ''
+        else:
+            detail = repr(operand)
+        lines.append(f"{index:>6} {OPCODE_NAMES[opcode]:<18} {detail}".rstrip())
+    for child in code.children:
+        lines.append('')
+        disassemble(child, lines)
+    return '\n'.join(lines)
+
+# Bytecode Virtual Machine
+class BytecodeInterpreter(Interpreter):
+    # The VM addresses variables by name
+    resolve_scopes = False
+    
+    def __init__(self, tree, output=None):
+        super().__init__(tree, output)
+        self.compiler = BytecodeCompiler(self.is_truthy, self.call_sites)
+        self.code = self.compiler.compile_block(tree.statements)
+    
+    def run_program(self):
+        self.run(self.code, self.global_env)
+    
+    def execute_block(self, statements, env, instance=None):
+        # Entry point for Class.call
+        if instance:
+            env.set('self', instance)
+        self.run(self.code_for(statements), env)
+    
+    def call_function(self, func, env):
+        # Entry point for Function.call; run() makes the tail calls itself
+        return self.run(self.code_for(func.body), env)
+    
+    def code_for(self, statements):
+        entry = self.compiler.codes.get(id(statements))
+        return entry[1] if entry else self.compiler.compile_block(statements)
+    
+    def run(self, code, env):
+        instructions = code.instructions
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        # (handler pc, environment, stack depth) for each active Protego
+        handlers = []
+        # Incantations called from bytecode run in this loop rather than in a
+        # nested run(); each saves its caller's state here
+        frames = []
+        is_truthy = self.is_truthy
+        write = self.output.write
+        pc = 0
+        while True:
+            try:
+                # Opcodes are tested roughly in order of how often they execute
+                while True:
+                    opcode, operand = instructions[pc]
+                    pc += 1
+                    if opcode == LOAD_NAME:
+                        push(env.get(operand))
+                    elif opcode == BINARY_NAME_CONST:
+                        function, node, name, constant = operand
+                        left = env.get(name)
+                        try:
+                            push(function(left, constant))
+                        except Exception as e:
+                            raise RuntimeErrorSL(str(e), node)
+                    elif opcode == STORE_NAME:
+                        env.update(operand, pop())
+                    elif opcode == JUMP_IF_FALSE:
+                        if not is_truthy(pop()):
+                            pc = operand
+                    elif opcode == BINARY_NAME_NAME:
+                        function, node, name, other = operand
+                        left = env.get(name)
+                        right = env.get(other)
+                        try:
+                            push(function(left, right))
+                        except Exception as e:
+                            raise RuntimeErrorSL(str(e), node)
+                    elif opcode == LOAD_CONST:
+                        push(operand)
+                    elif opcode == JUMP:
+                        pc = operand
+                    elif opcode == BINARY_STACK_CONST:
+                        function, node, constant = operand
+                        left = pop()
+                        try:
+                            push(function(left, constant))
+                        except Exception as e:
+                            raise RuntimeErrorSL(str(e), node)
+                    elif opcode == BINARY_OP:
+                        right = pop()
+                        left = pop()
+                        try:
+                            push(operand[0](left, right))
+                        except Exception as e:
+                            raise RuntimeErrorSL(str(e), operand[1])
+                    elif opcode == BINARY_STACK_NAME:
+                        function, node, name = operand
+                        left = pop()
+                        right = env.get(name)
+                        try:
+                            push(function(left, right))
+                        except Exception as e:
+                            raise RuntimeErrorSL(str(e), node)
+                    elif opcode == PUSH_SCOPE:
+                        env = Environment(env)
+                    elif opcode == POP_SCOPE:
+                        env = env.parent
+                    elif opcode == DEFINE_NAME:
+                        env.set(operand, pop())
+                    elif opcode == LOAD_CALLEE:
+                        name, node, statement, end, site = operand
+                        func = env.get(name)
+                        if func is site.callee:
+                            site.hits += 1
+                        else:
+                            site.update(func, len(node.args))
+                            if site.kind == 'function':
+                                site.target = self.code_for(func.body).instructions
+                        if site.kind != 'generic':
+                            push(func)
+                        elif isinstance(func, Function) or callable(func) or (not statement and isinstance(func, Class)):
+                            push(func)
+                        elif isinstance(func, Instance):
+                            if not statement:
+                                push(None)
+                            pc = end
+                        elif statement:
+                            raise RuntimeErrorSL(f"'{name}' is not a function", node)
+                        else:
+                            raise RuntimeErrorSL(f"'{name}' is not a function or class", node)
+                    elif opcode == CALL:
+                        count, node, statement, site, tail = operand
+                        if count:
+                            args = stack[-count:]
+                            del stack[-count:]
+                        else:
+                            args = []
+                        func = pop()
+                        if isinstance(func, Function) and func.memo is not None:
+                            # Runs in a nested run() on a cache miss
+                            result = func.call(self, args)
+                            if not statement:
+                                push(result)
+                        elif isinstance(func, Function):
+                            if func is site.callee and site.kind == 'function':
+                                callee_env = func.enter(args)
+                                body = site.target
+                            else:
+                                callee_env = func.bind(args)
+                                body = self.code_for(func.body).instructions
+                            # A tail call takes over the frame of the body
+                            # making it, which has nothing left to run, and
+                            # returns straight to that body's caller. That
+                            # body gives None if it ends with a Cast statement,
+                            # so a caller wanting its value gets None now.
+                            if tail and frames:
+                                if statement and not frames[-1][5]:
+                                    caller = frames[-1]
+                                    caller[3].append(None)
+                                    frames[-1] = caller[:5] + (True,)
+                            else:
+                                frames.append((instructions, pc, env, stack, handlers, statement))
+                            instructions = body
+                            pc = 0
+                            env = callee_env
+                            stack = []
+                            push = stack.append
+                            pop = stack.pop
+                            handlers = []
+                        elif isinstance(func, Class):
+                            result = func.call(self, args)
+                            if not statement:
+                                push(result)
+                        elif statement:
+                            func(*args)
+                        else:
+                            try:
+                                push(func(*args))
+                            except Exception as e:
+                                raise RuntimeErrorSL(str(e), node)
+                    elif opcode == LOAD_METHOD:
+                        func = self.get_member(pop(), operand)
+                        if not (isinstance(func, (Function, Class)) or callable(func)):
+                            raise RuntimeErrorSL(f"'{operand.name}' is not a method", operand)
+                        push(func)
+                    elif opcode == LOAD_MEMBER:
+                        push(self.get_member(pop(), operand))
+                    elif opcode == RETURN:
+                        if not frames:
+                            return None
+                        instructions, pc, env, stack, handlers, statement = frames.pop()
+                        push = stack.append
+                        pop = stack.pop
+                        if not statement:
+                            push(None)
+                    elif opcode == RETURN_VALUE:
+                        # Leaves the body from however deep in its blocks and
+                        # Protegos, which all live in the frame being dropped
+                        value = pop()
+                        if not frames:
+                            return value
+                        instructions, pc, env, stack, handlers, statement = frames.pop()
+                        push = stack.append
+                        pop = stack.pop
+                        if not statement:
+                            push(value)
+                    elif opcode == UNARY_OP:
+                        value = pop()
+                        try:
+                            push(operand[0](value))
+                        except Exception as e:
+                            raise RuntimeErrorSL(str(e), operand[1])
+                    elif opcode == PRINT:
+                        write(str(pop()) + '\n')
+                    elif opcode == BUILD_LIST:
+                        if operand:
+                            items = stack[-operand:]
+                            del stack[-operand:]
+                        else:
+                            items = []
+                        push(items)
+                    elif opcode == BUILD_DICT:
+                        items = {}
+                        if operand:
+                            flat = stack[-2 * operand:]
+                            del stack[-2 * operand:]
+                            for i in range(0, len(flat), 2):
+                                items[flat[i]] = flat[i + 1]
+                        push(items)
+                    elif opcode == SETUP_TRY:
+                        handlers.append((operand, env, len(stack)))
+                    elif opcode == POP_TRY:
+                        handlers.pop()
+                    elif opcode == MAKE_FUNCTION:
+                        name, params, body, memo_size = operand
+                        func = Function(name, params, body, env, memo_size=memo_size)
+                        self.functions[name] = func
+                        env.set(name, func)
+                    elif opcode == MAKE_CLASS:
+                        name, params, body, methods, init = operand
+                        cls = Class(name, params, body, env, methods=methods, init=init)
+                        self.classes[name] = cls
+                        env.set(name, cls)
+                    elif opcode == MAKE_SUBCLASS:
+                        child, parent, node = operand
+                        if parent not in self.classes:
+                            raise RuntimeErrorSL(f"Parent class '{parent}' not found.", node)
+                        cls = Class(child, [], [], env, parent=self.classes[parent])
+                        self.classes[child] = cls
+                        env.set(child, cls)
+                    elif opcode == FAIL:
+                        raise RuntimeErrorSL(operand[0], operand[1])
+            except SpellLangError:
+                # Unwind to the innermost Protego, in this call or a caller
+                while not handlers:
+                    if not frames:
+                        raise
+                    instructions, pc, env, stack, handlers, statement = frames.pop()
+                pc, env, depth = handlers.pop()
+                del stack[depth:]
+                push = stack.append
+                pop = stack.pop
+
+# Execution engines selectable from the command line
+ENGINES = {
+    'tree': Interpreter,
+    'closure': ClosureInterpreter,
+    'vm': BytecodeInterpreter,
+    'stack': StackInterpreter,
+}
+
 # Main Execution
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python spelllang_interpreter.py <filename.spell>")
-        sys.exit(1)
-    
-    filename = sys.argv[1]
+    arg_parser = argparse.ArgumentParser(prog='spelllang_interpreter.py', description='Run a SpellLang program.')
+    arg_parser.add_argument('filename', help='the .spell file to run')
+    arg_parser.add_argument('--engine', choices=ENGINES, default='tree',
+                            help="execution engine: the AST walker ('tree'), compiled closures ('closure'), "
+                                 "the bytecode virtual machine ('vm') or the AST walker on an explicit stack "
+                                 "('stack'), which has no recursion limit")
+    arg_parser.add_argument('--disassemble', action='store_true',
+                            help='print the bytecode of the program instead of running it')
+    arg_parser.add_argument('--optimize', action='store_true',
+                            help='fold constant expressions before running and report the nodes removed')
+    arg_parser.add_argument('--call-stats', action='store_true',
+                            help='report call-site inline cache hits and misses after running')
+    arg_parser.add_argument('--output', metavar='PATH',
+                            help='write Illuminate output to PATH instead of standard output')
+    arg_parser.add_argument('--flush-lines', type=int, metavar='N',
+                            help='write Illuminate output out every N lines (default: each line on a '
+                                 f'terminal, otherwise {OUTPUT_BATCH_LINES})')
+    arg_parser.add_argument('--memo-stats', action='store_true',
+                            help='report the result cache of each Remembrall Incantation after running')
+    args = arg_parser.parse_args()
+    
+    filename = args.filename
     try:
         with open(filename, 'r') as f:
             code = f.read()
@@ -901,25 +3773,49 @@ def main():
         print(f"File '{filename}' not found.")
         sys.exit(1)
     
-    # Lexing
+    # Lexing and parsing, streaming tokens from the lexer into the parser
     lexer = Lexer(code)
-    try:
-        tokens = lexer.tokenize()
-    except LexerError as e:
-        print(e)
-        sys.exit(1)
-    
-    # Parsing
-    parser = Parser(tokens)
+    parser = StreamingParser(lexer.iter_tokens())
     try:
         tree = parser.parse()
-    except ParserError as e:
+    except (LexerError, ParserError) as e:
         print(e)
         sys.exit(1)
     
+    if args.optimize:
+        optimizer = Optimizer()
+        optimizer.optimize(tree)
+        print(f"Optimizer removed {optimizer.removed} AST nodes", file=sys.stderr)
+    
+    if args.disassemble:
+        print(disassemble(BytecodeCompiler(bool).compile_block(tree.statements)))
+        return
+    
     # Interpreting
-    interpreter = Interpreter(tree)
-    interpreter.interpret()
+    engine = ENGINES[args.engine]
+    if engine.resolve_scopes:
+        Resolver().resolve(tree)
+    if args.output is not None:
+        try:
+            output = FileSink(args.output, args.flush_lines or OUTPUT_BATCH_LINES)
+        except OSError as e:
+            print(f"Cannot write to '{args.output}': {e.strerror}")
+            sys.exit(1)
+    else:
+        output = BufferedSink(sys.stdout, args.flush_lines)
+    interpreter = engine(tree, output)
+    try:
+        interpreter.interpret()
+    finally:
+        output.close()
+    if args.call_stats:
+        stats = interpreter.call_cache_stats()
+        print(f"Call sites: {stats['sites']}, cache hits: {stats['hits']}, misses: {stats['misses']}", file=sys.stderr)
+    if args.memo_stats:
+        for name, stats in interpreter.memo_stats().items():
+            print(f"Remembrall {name}: hits: {stats['hits']}, misses: {stats['misses']}, "
+                  f"evictions: {stats['evictions']}, skipped: {stats['skipped']}, cached: {stats['cached']}",
+                  file=sys.stderr)
 
 if __name__ == "__main__":
     main()